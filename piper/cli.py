@@ -0,0 +1,338 @@
+# vim: set expandtab shiftwidth=4 tabstop=4:
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next
+# paragraph) shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""
+piperctl, the command-line front end of Piper. It only uses the ratbagd
+bindings and never imports Gtk, so it starts quickly and works without a
+display, e.g. over SSH:
+
+    piperctl list
+    piperctl show -d mock0
+    piperctl set-resolution -p 0 1 1600
+    piperctl apply mouse.json
+    piperctl export g500.json
+    piperctl provision g500.json
+
+All changes, including a whole config, are diffed against the current
+device state and written in one transaction; values the device already
+has are not written again.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from piper.devicestate import (DeviceState, ProfileState, ResolutionState,
+                               ButtonState, diff, apply_writes)
+from piper.profilefile import ProfileFile, ProfileFileError, provision
+from piper.ratbagd import Ratbagd, RatbagdDBusUnavailable
+
+
+class CliError(Exception):
+    pass
+
+
+def _find_device(ratbag, name):
+    """Returns the RatbagdDevice matching name, either its object path, the
+    last component of it or its id. The first device if name is None."""
+    paths = ratbag.devices.object_paths
+    if not paths:
+        raise CliError("No devices found")
+    if name is None:
+        return ratbag.devices[0]
+
+    for i, path in enumerate(paths):
+        if name in (path, os.path.basename(path)):
+            return ratbag.devices[i]
+    # ids are only known once the device is loaded
+    for device in ratbag.devices:
+        if device.id == name:
+            return device
+    raise CliError("No device {}".format(name))
+
+
+def _profile_index(device, index):
+    if index is None:
+        active = device.active_profile
+        return active.index if active is not None else 0
+    if not 0 <= index < len(device.profiles):
+        raise CliError("No profile {}".format(index))
+    return index
+
+
+def _write(device, desired, dry_run):
+    try:
+        writes = diff(DeviceState.from_device(device), desired)
+    except ValueError as e:
+        raise CliError(str(e))
+
+    if dry_run or not writes:
+        for w in writes:
+            print("{} {}{}".format(w.path, w.method, tuple(w.args)))
+        if not writes:
+            print("Nothing to change")
+        return 0
+
+    failed = apply_writes(device, writes)
+    for obj, method, error in failed:
+        print("Failed to {} on {}: {}".format(method, obj._objpath, error.message),
+              file=sys.stderr)
+    return 1 if failed else 0
+
+
+def _describe_button(button):
+    action = button.action_type
+    if action == "button":
+        return "button {}".format(button.button_mapping)
+    if action == "special":
+        return "special {}".format(button.special)
+    if action == "key":
+        return "key {}".format(" ".join(str(k) for k in button.key))
+    if action == "macro":
+        return "macro {}".format(" ".join("{}:{}".format(t, v) for t, v in button.macro))
+    return action
+
+
+def cmd_list(ratbag, args):
+    paths = ratbag.devices.object_paths
+    descriptions = ratbag.get_device_descriptions(paths)
+    for path, description in zip(paths, descriptions):
+        print("{}\t{}".format(os.path.basename(path), description or "(unavailable)"))
+    return 0
+
+
+def cmd_show(ratbag, args):
+    device = _find_device(ratbag, args.device)
+    if args.json:
+        json.dump(DeviceState.from_device(device).to_dict(), sys.stdout, indent=2)
+        print()
+        return 0
+
+    active = device.active_profile
+    print("{} ({})".format(device.description, device.id))
+    for profile in device.profiles:
+        marker = " (active)" if active is not None and profile.index == active.index else ""
+        print("  Profile {}{}".format(profile.index, marker))
+        default = profile.default_resolution
+        current = profile.active_resolution
+        for r in profile.resolutions:
+            flags = []
+            if current is not None and r.index == current.index:
+                flags.append("active")
+            if default is not None and r.index == default.index:
+                flags.append("default")
+            print("    Resolution {}: {}x{} dpi, {} Hz{}".format(
+                r.index, r.resolution[0], r.resolution[1], r.report_rate,
+                " ({})".format(", ".join(flags)) if flags else ""))
+        for b in profile.buttons:
+            print("    Button {}: {}".format(b.index, _describe_button(b)))
+    return 0
+
+
+def cmd_set_profile(ratbag, args):
+    device = _find_device(ratbag, args.device)
+    return _write(device, DeviceState(active_profile=args.index), args.dry_run)
+
+
+def cmd_set_resolution(ratbag, args):
+    device = _find_device(ratbag, args.device)
+    yres = args.yres if args.yres is not None else args.xres
+    res = ResolutionState(index=args.index, resolution=(args.xres, yres))
+    profile = ProfileState(index=_profile_index(device, args.profile), resolutions=(res,))
+    return _write(device, DeviceState(profiles=(profile,)), args.dry_run)
+
+
+def cmd_set_rate(ratbag, args):
+    device = _find_device(ratbag, args.device)
+    index = _profile_index(device, args.profile)
+    # without a resolution, the rate applies to all of them like in Piper
+    if args.resolution is not None:
+        indices = [args.resolution]
+    else:
+        indices = range(len(device.profiles[index].resolutions))
+    res = tuple(ResolutionState(index=i, report_rate=args.rate) for i in indices)
+    profile = ProfileState(index=index, resolutions=res)
+    return _write(device, DeviceState(profiles=(profile,)), args.dry_run)
+
+
+def cmd_set_button(ratbag, args):
+    device = _find_device(ratbag, args.device)
+    if args.button is not None:
+        button = ButtonState(index=args.index, action_type="button",
+                             button_mapping=args.button)
+    elif args.special is not None:
+        button = ButtonState(index=args.index, action_type="special",
+                             special=args.special)
+    elif args.key is not None:
+        button = ButtonState(index=args.index, action_type="key",
+                             key=tuple(args.key))
+    else:
+        button = ButtonState(index=args.index, action_type="none")
+    profile = ProfileState(index=_profile_index(device, args.profile), buttons=(button,))
+    return _write(device, DeviceState(profiles=(profile,)), args.dry_run)
+
+
+def load_config(path):
+    """Reads a config file as written by show --json, JSON or, if the
+    file name ends in .toml, TOML."""
+    try:
+        if path.endswith(".toml"):
+            try:
+                import tomllib
+            except ImportError:
+                raise CliError("TOML needs Python 3.11 or later")
+            with open(path, "rb") as f:
+                config = tomllib.load(f)
+        else:
+            with open(path) as f:
+                config = json.load(f)
+    except (OSError, ValueError) as e:
+        raise CliError("Failed to read {}: {}".format(path, e))
+
+    try:
+        return DeviceState.from_dict(config)
+    except (TypeError, ValueError) as e:
+        raise CliError("Invalid config {}: {}".format(path, e))
+
+
+def cmd_apply(ratbag, args):
+    desired = load_config(args.config)
+    if args.force:
+        # any device will do, by default the first one
+        desired = desired.replace(id=None)
+    elif args.device is None and desired.id is not None:
+        args.device = desired.id
+    device = _find_device(ratbag, args.device)
+    return _write(device, desired, args.dry_run)
+
+
+def cmd_export(ratbag, args):
+    device = _find_device(ratbag, args.device)
+    try:
+        ProfileFile.from_device(device).save(args.file)
+    except OSError as e:
+        raise CliError("Failed to write {}: {}".format(args.file, e))
+    return 0
+
+
+def cmd_provision(ratbag, args):
+    try:
+        profile = ProfileFile.load(args.file)
+    except (OSError, ProfileFileError) as e:
+        raise CliError("Failed to read {}: {}".format(args.file, e))
+
+    results = provision(ratbag, profile)
+    if not results:
+        raise CliError("No device matches {} ({})".format(args.file, profile.description))
+
+    status = 0
+    for r in results:
+        if r.error is not None:
+            outcome = "error: {}".format(r.error)
+        elif r.failed:
+            outcome = "{} of {} writes failed: {}".format(
+                len(r.failed), r.writes,
+                "; ".join("{} {}".format(m, e.message) for _, m, e in r.failed))
+        else:
+            outcome = "ok, {} writes".format(r.writes)
+        if r.error is not None or r.failed:
+            status = 1
+        name = os.path.basename(r.object_path)
+        print("{}\t{:8.1f} ms\t{}".format(name, 1000 * r.seconds, outcome))
+    return status
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="piperctl",
+                                     description="Configure gaming mice through ratbagd")
+    sub = parser.add_subparsers(dest="command", metavar="COMMAND")
+    sub.required = True
+
+    def command(name, func, help, device=True, write=False):
+        p = sub.add_parser(name, help=help)
+        p.set_defaults(func=func)
+        if device:
+            p.add_argument("-d", "--device",
+                           help="Device object path, name or id, default: the first device")
+        if write:
+            p.add_argument("-n", "--dry-run", action="store_true",
+                           help="Only print the calls that would be made")
+        return p
+
+    command("list", cmd_list, "List the devices", device=False)
+
+    p = command("show", cmd_show, "Show the profiles, resolutions and buttons of a device")
+    p.add_argument("--json", action="store_true",
+                   help="Print the state as config, see apply")
+
+    p = command("set-profile", cmd_set_profile, "Set the active profile", write=True)
+    p.add_argument("index", type=int)
+
+    p = command("set-resolution", cmd_set_resolution, "Set a resolution in dpi", write=True)
+    p.add_argument("-p", "--profile", type=int, help="Default: the active profile")
+    p.add_argument("index", type=int)
+    p.add_argument("xres", type=int)
+    p.add_argument("yres", type=int, nargs="?", help="Default: xres")
+
+    p = command("set-rate", cmd_set_rate, "Set the report rate in Hz", write=True)
+    p.add_argument("-p", "--profile", type=int, help="Default: the active profile")
+    p.add_argument("-r", "--resolution", type=int, help="Default: all resolutions")
+    p.add_argument("rate", type=int)
+
+    p = command("set-button", cmd_set_button, "Set a button mapping", write=True)
+    p.add_argument("-p", "--profile", type=int, help="Default: the active profile")
+    p.add_argument("index", type=int)
+    action = p.add_mutually_exclusive_group(required=True)
+    action.add_argument("--button", type=int, help="Map to a button")
+    action.add_argument("--special", help="Map to a special function, e.g. wheel-up")
+    action.add_argument("--key", type=int, nargs="+", metavar="KEYCODE",
+                        help="Map to a keycode followed by modifier keycodes")
+    action.add_argument("--disable", action="store_true", help="Disable the button")
+
+    p = command("apply", cmd_apply,
+                "Apply a JSON or TOML config in one pass, see show --json", write=True)
+    p.add_argument("config")
+    p.add_argument("-f", "--force", action="store_true",
+                   help="Apply even if the config is for a device with another id")
+
+    p = command("export", cmd_export, "Write the profiles of a device to a profile file")
+    p.add_argument("file")
+
+    p = command("provision", cmd_provision,
+                "Apply a profile file to all devices of its model at once", device=False)
+    p.add_argument("file")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=sys.argv[1:]):
+    args = parse_args(argv)
+    try:
+        ratbag = Ratbagd()
+        return args.func(ratbag, args)
+    except RatbagdDBusUnavailable:
+        print("Can't connect to ratbagd on DBus", file=sys.stderr)
+    except CliError as e:
+        print(e, file=sys.stderr)
+    return 1
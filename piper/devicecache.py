@@ -0,0 +1,110 @@
+# vim: set expandtab shiftwidth=4 tabstop=4:
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next
+# paragraph) shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+import os
+
+from gi.repository import GLib
+
+
+class DeviceCache(object):
+    """The last known state of each device on disk, keyed by
+    RatbagdDevice.id, so that a device can be shown before ratbagd was
+    queried. See RatbagdDevice.get_state() and
+    RatbagdDevice.preload_state().
+
+    Each device is stored in its own file as a serialized GLib.Variant of
+    type (ussv): the format version, the device id, its object path and
+    its state.
+
+    @param directory The directory of the cache files, by default piper/
+                     in the user's cache directory
+    """
+
+    VERSION = 1
+    TYPE = "(ussv)"
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = os.path.join(GLib.get_user_cache_dir(), "piper", "devices")
+        self._directory = directory
+
+    def _filename(self, device_id):
+        name = "".join(c if c.isalnum() or c in "-_." else "_" for c in device_id)
+        return os.path.join(self._directory, "{}.state".format(name))
+
+    def _read(self, filename):
+        try:
+            with open(filename, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        variant = GLib.Variant.new_from_bytes(GLib.VariantType.new(self.TYPE),
+                                              GLib.Bytes.new(data), False)
+        # A truncated or foreign file deserializes to garbage, not an error
+        if not variant.is_normal_form():
+            return None
+        if variant.get_child_value(0).get_uint32() != self.VERSION:
+            return None
+        return variant
+
+    def lookup(self, device_id, object_path):
+        """Returns the tuple (id, state) last stored for the device with
+        the given id, or None. Only the file of that id is read. A state
+        stored under another object path is not returned, as its profiles,
+        resolutions and buttons have other paths now."""
+        if device_id is None:
+            return None
+        variant = self._read(self._filename(device_id))
+        if variant is None:
+            return None
+        if variant.get_child_value(1).get_string() != device_id:
+            return None
+        if variant.get_child_value(2).get_string() != object_path:
+            return None
+        return (device_id, variant.get_child_value(3).get_variant())
+
+    def store(self, object_path, device):
+        """Stores the current state of the given RatbagdDevice, replacing
+        the previous one.
+
+        @param object_path The DBus object path of the device
+        """
+        variant = GLib.Variant(self.TYPE, (self.VERSION, device.id,
+                                           object_path, device.get_state()))
+        filename = self._filename(device.id)
+        try:
+            os.makedirs(self._directory, exist_ok=True)
+            # Write and rename, so a crash never leaves a partial file
+            with open(filename + ".tmp", "wb") as f:
+                f.write(variant.get_data_as_bytes().get_data())
+            os.replace(filename + ".tmp", filename)
+        except OSError as e:
+            print("Failed to write the device cache: {}".format(e))
+
+    def remove(self, device_id):
+        """Removes the stored state of the device with the given id."""
+        try:
+            os.remove(self._filename(device_id))
+        except OSError:
+            pass
@@ -0,0 +1,431 @@
+# vim: set expandtab shiftwidth=4 tabstop=4:
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next
+# paragraph) shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""
+Immutable snapshots of the state of a device and the writes needed to get
+from one state to another.
+
+DeviceState.from_device() takes a snapshot of a RatbagdDevice. A desired
+state is built the same way or by hand, leaving anything that should not
+be changed as None. diff() then returns only the calls that change
+something, and apply_writes() stages them in one transaction:
+
+    current = DeviceState.from_device(device)
+    desired = current.with_profile(ProfileState(index=0, resolutions=(
+        ResolutionState(index=0, resolution=(800, 800)),)))
+    failed = apply_writes(device, diff(current, desired))
+"""
+
+import collections
+
+
+Write = collections.namedtuple("Write", ["path", "key", "method", "signature", "args"])
+Write.__doc__ = """A method call on the ratbagd object at path. key is the
+transaction key of what the call changes, see _RatbagdDBus.dbus_write()."""
+
+
+# The largest value of the DBus "u" type all numbers are sent as
+_UINT32_MAX = 0xffffffff
+
+
+def _is_uint(value):
+    return isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= _UINT32_MAX
+
+
+def _is_uints(value, length=None):
+    if not isinstance(value, tuple) or length not in (None, len(value)):
+        return False
+    return all(_is_uint(v) for v in value)
+
+
+def _is_str(value):
+    return isinstance(value, str)
+
+
+def _is_macro(value):
+    # (type, value) pairs, the types are NONE to WAIT of RatbagdMacro
+    if not isinstance(value, tuple):
+        return False
+    return all(_is_uints(e, 2) and e[0] <= 3 for e in value)
+
+
+class _State(object):
+    """Base class of the snapshots. All fields are passed as keyword
+    arguments and default to None, meaning "unknown" in a snapshot and
+    "leave as is" in a desired state."""
+
+    __slots__ = ()
+
+    # Fields holding a tuple of other states, by their class
+    _CHILDREN = {}
+
+    # The checks of the plain fields from_dict() accepts, by field
+    _CHECKS = {
+        "index": _is_uint,
+    }
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            object.__setattr__(self, name, fields.pop(name, None))
+        if fields:
+            raise TypeError("Unknown fields {}".format(", ".join(fields)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("{} is immutable".format(type(self).__name__))
+
+    def __delattr__(self, name):
+        raise AttributeError("{} is immutable".format(type(self).__name__))
+
+    def _values(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._values() == other._values()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._values())
+
+    def __repr__(self):
+        fields = ("{}={!r}".format(n, getattr(self, n)) for n in self.__slots__
+                  if getattr(self, n) is not None)
+        return "{}({})".format(type(self).__name__, ", ".join(fields))
+
+    def replace(self, **fields):
+        """Returns a copy with the given fields replaced."""
+        values = {name: getattr(self, name) for name in self.__slots__}
+        values.update(fields)
+        return type(self)(**values)
+
+    def to_dict(self):
+        """Returns the state as a dict of plain values, e.g. to write it as
+        JSON. Object paths and fields that are None are left out."""
+        result = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if value is None or name == "path":
+                continue
+            if name in self._CHILDREN:
+                value = [v.to_dict() for v in value]
+            elif isinstance(value, tuple):
+                value = list(value)
+            result[name] = value
+        return result
+
+    @classmethod
+    def from_dict(cls, values):
+        """Creates a state from a dict as returned by to_dict(), e.g. read
+        from a config file. Raises ValueError on unknown fields and on
+        values of the wrong type or out of range."""
+        if not isinstance(values, dict):
+            raise ValueError("Expected a table for {}".format(cls.__name__))
+        fields = {}
+        for name, value in values.items():
+            if name not in cls.__slots__ or name == "path":
+                raise ValueError("Unknown field {} for {}".format(name, cls.__name__))
+            if name in cls._CHILDREN:
+                if not isinstance(value, list):
+                    raise ValueError("Expected a list for {} of {}".format(name, cls.__name__))
+                value = tuple(cls._CHILDREN[name].from_dict(v) for v in value)
+            else:
+                check = cls._CHECKS.get(name)
+                converted = _to_tuples(value)
+                if value is not None and check is not None and not check(converted):
+                    raise ValueError("Invalid {} {!r} for {}".format(name, value, cls.__name__))
+                value = converted
+            fields[name] = value
+        return cls(**fields)
+
+
+def _to_tuples(value):
+    # Lists from JSON or TOML become tuples at all levels, e.g. the events
+    # of a macro, so states stay hashable and compare equal to snapshots
+    if isinstance(value, list):
+        return tuple(_to_tuples(v) for v in value)
+    return value
+
+
+class ResolutionState(_State):
+    __slots__ = ("path", "index", "resolution", "report_rate")
+
+    _CHECKS = dict(_State._CHECKS,
+                   resolution=lambda v: _is_uints(v, 2),
+                   report_rate=_is_uint)
+
+    @classmethod
+    def from_resolution(cls, resolution):
+        return cls(path=resolution._objpath,
+                   index=resolution.index,
+                   resolution=tuple(resolution.resolution),
+                   report_rate=resolution.report_rate)
+
+
+class ButtonState(_State):
+    """action_type decides which of button_mapping, special, key and macro
+    is written, as in RatbagdButton. macro is a tuple of (type, value)
+    pairs, see RatbagdMacro."""
+
+    __slots__ = ("path", "index", "action_type", "button_mapping", "special", "key", "macro")
+
+    _CHECKS = dict(_State._CHECKS,
+                   action_type=_is_str,
+                   button_mapping=_is_uint,
+                   special=_is_str,
+                   key=_is_uints,
+                   macro=_is_macro)
+
+    @classmethod
+    def from_button(cls, button):
+        key = button.key
+        return cls(path=button._objpath,
+                   index=button.index,
+                   action_type=button.action_type,
+                   button_mapping=button.button_mapping,
+                   special=button.special,
+                   key=tuple(key) if key is not None else None,
+                   macro=tuple(button.macro))
+
+
+class ProfileState(_State):
+    """resolutions and buttons are tuples of ResolutionState and
+    ButtonState. In a desired state they may be a subset, matched to the
+    current state by index."""
+
+    __slots__ = ("path", "index", "default_resolution", "resolutions", "buttons")
+
+    _CHECKS = dict(_State._CHECKS,
+                   default_resolution=_is_uint)
+
+    _CHILDREN = {
+        "resolutions": ResolutionState,
+        "buttons": ButtonState,
+    }
+
+    @classmethod
+    def from_profile(cls, profile):
+        default = profile.default_resolution
+        return cls(path=profile._objpath,
+                   index=profile.index,
+                   default_resolution=default.index if default is not None else None,
+                   resolutions=tuple(ResolutionState.from_resolution(r)
+                                     for r in profile.resolutions),
+                   buttons=tuple(ButtonState.from_button(b) for b in profile.buttons))
+
+
+class DeviceState(_State):
+    """profiles is a tuple of ProfileState. In a desired state it may be
+    a subset, matched to the current state by index."""
+
+    __slots__ = ("path", "id", "active_profile", "profiles")
+
+    _CHECKS = {
+        "id": _is_str,
+        "active_profile": _is_uint,
+    }
+
+    _CHILDREN = {
+        "profiles": ProfileState,
+    }
+
+    @classmethod
+    def from_device(cls, device):
+        active = device.active_profile
+        return cls(path=device._objpath,
+                   id=device.id,
+                   active_profile=active.index if active is not None else None,
+                   profiles=tuple(ProfileState.from_profile(p) for p in device.profiles))
+
+    def with_profile(self, profile):
+        """Returns a copy with the profile of the same index replaced or,
+        if there is none, added."""
+        profiles = [p for p in self.profiles or () if p.index != profile.index]
+        profiles.append(profile)
+        return self.replace(profiles=tuple(sorted(profiles, key=lambda p: p.index)))
+
+
+def _by_index(states, kind):
+    result = {}
+    for s in states or ():
+        if s.index is None:
+            raise ValueError("{} without index".format(kind))
+        result[s.index] = s
+    return result
+
+
+def _diff_resolution(current, desired):
+    writes = []
+    if desired.resolution is not None and tuple(desired.resolution) != current.resolution:
+        writes.append(Write(current.path, "resolution", "SetResolution", "uu",
+                            tuple(desired.resolution)))
+    if desired.report_rate is not None and desired.report_rate != current.report_rate:
+        writes.append(Write(current.path, "report-rate", "SetReportRate", "u",
+                            (desired.report_rate,)))
+    return writes
+
+
+# The ButtonState field holding the mapping of each action type
+_MAPPING_FIELDS = {
+    "button": "button_mapping",
+    "special": "special",
+    "key": "key",
+    "macro": "macro",
+}
+
+
+def _diff_button(current, desired):
+    action = desired.action_type
+    if action is None:
+        # a mapping without action type implies it
+        if desired.button_mapping is not None:
+            action = "button"
+        elif desired.special is not None:
+            action = "special"
+        elif desired.key is not None:
+            action = "key"
+        elif desired.macro is not None:
+            action = "macro"
+        else:
+            return []
+
+    same_action = action == current.action_type
+    if action in ("button", "special", "key", "macro"):
+        field = _MAPPING_FIELDS[action]
+        value = getattr(desired, field)
+        if value is None:
+            # only the action type changes, keep the mapping the device has
+            value = getattr(current, field)
+        # keycode 0 is what ratbagd reports for buttons without a key
+        if not value or (action == "key" and not value[0]):
+            raise ValueError("No {} for button {}".format(field, current.index))
+
+    if action == "button":
+        if not same_action or value != current.button_mapping:
+            return [Write(current.path, "mapping", "SetButtonMapping", "u", (value,))]
+    elif action == "special":
+        if not same_action or value != current.special:
+            return [Write(current.path, "mapping", "SetSpecialMapping", "s", (value,))]
+    elif action == "key":
+        value = tuple(value)
+        if not same_action or value != current.key:
+            return [Write(current.path, "mapping", "SetKeyMapping", "au", (list(value),))]
+    elif action == "macro":
+        value = tuple(tuple(e) for e in value)
+        if not same_action or value != current.macro:
+            return [Write(current.path, "mapping", "SetMacro", "a(uu)", (list(value),))]
+    elif action == "none":
+        if not same_action:
+            return [Write(current.path, "mapping", "Disable", "", ())]
+    else:
+        raise ValueError("Cannot set action type {}".format(action))
+    return []
+
+
+def diff(current, desired):
+    """Compares a desired DeviceState with the current one and returns the
+    list of Write calls needed to get there, skipping everything that
+    already has the desired value. The profiles are written in order of
+    their index, the change of the active profile comes last so a profile
+    is complete once it becomes active.
+
+    Raises ValueError if the desired state refers to profiles, resolutions
+    or buttons that don't exist in the current state.
+    """
+    if desired.id is not None and desired.id != current.id:
+        raise ValueError("State is for device {}, not {}".format(desired.id, current.id))
+
+    writes = []
+    profiles = _by_index(current.profiles, "Profile")
+    for index, want in sorted(_by_index(desired.profiles, "Profile").items()):
+        have = profiles.get(index)
+        if have is None:
+            raise ValueError("No profile {}".format(index))
+
+        resolutions = _by_index(have.resolutions, "Resolution")
+        for i, r in sorted(_by_index(want.resolutions, "Resolution").items()):
+            if i not in resolutions:
+                raise ValueError("No resolution {} in profile {}".format(i, index))
+            writes += _diff_resolution(resolutions[i], r)
+
+        if want.default_resolution is not None and want.default_resolution != have.default_resolution:
+            if want.default_resolution not in resolutions:
+                raise ValueError("No resolution {} in profile {}".format(want.default_resolution, index))
+            writes.append(Write(resolutions[want.default_resolution].path, "default",
+                                "SetDefault", "", ()))
+
+        buttons = _by_index(have.buttons, "Button")
+        for i, b in sorted(_by_index(want.buttons, "Button").items()):
+            if i not in buttons:
+                raise ValueError("No button {} in profile {}".format(i, index))
+            writes += _diff_button(buttons[i], b)
+
+    if desired.active_profile is not None and desired.active_profile != current.active_profile:
+        if desired.active_profile not in profiles:
+            raise ValueError("No profile {}".format(desired.active_profile))
+        writes.append(Write(profiles[desired.active_profile].path, "active",
+                            "SetActive", "", ()))
+    return writes
+
+
+def stage_writes(transaction, writes):
+    """Stages the given writes in the open RatbagdTransaction of their
+    device."""
+    device = transaction._device
+    objects = {device._objpath: device}
+    for profile in device.profiles:
+        objects[profile._objpath] = profile
+        for obj in list(profile.resolutions) + list(profile.buttons):
+            objects[obj._objpath] = obj
+
+    for w in writes:
+        transaction.stage(objects[w.path], w.key, w.method, w.signature, *w.args)
+
+
+def apply_writes_async(device, writes, callback):
+    """Sends the given writes to the RatbagdDevice in one transaction, i.e.
+    one round trip, without blocking.
+
+    @param callback Called as callback(failed) with the list of (object,
+                    method, GLib.GError) for the calls that failed, see
+                    RatbagdTransaction.commit_async()
+    """
+    transaction = device.transaction()
+    try:
+        stage_writes(transaction, writes)
+    except Exception:
+        transaction.rollback()
+        raise
+    transaction.commit_async(callback)
+
+
+def apply_writes(device, writes):
+    """Blocking variant of apply_writes_async(), returns the list of failed
+    calls."""
+    transaction = device.transaction()
+    try:
+        stage_writes(transaction, writes)
+    except Exception:
+        transaction.rollback()
+        raise
+    return transaction.commit()
@@ -0,0 +1,143 @@
+# vim: set expandtab shiftwidth=4 tabstop=4:
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next
+# paragraph) shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+import hashlib
+import os
+
+import gi
+gi.require_version('GdkPixbuf', '2.0')
+from gi.repository import GdkPixbuf, Gio, GLib
+
+
+class ImageCache(object):
+    """Loads device images without blocking the main loop and keeps them
+    rasterized at the size they are shown at, in memory and as PNG on
+    disk. Entries are keyed by the path, modification time and size of the
+    image file and the target size, so a changed file is loaded again.
+
+    The file is read and decoded by GdkPixbuf in a worker thread; only
+    the callbacks run on the main loop.
+
+    @param directory The directory of the PNG files, by default piper/
+                     in the user's cache directory
+    """
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = os.path.join(GLib.get_user_cache_dir(), "piper", "images")
+        self._directory = directory
+        self._pixbufs = {}
+
+    def load_async(self, path, width, height, cancellable, callback, *args):
+        """Loads the image at path scaled to fit width and height, keeping
+        its aspect ratio; -1 leaves a dimension unconstrained.
+
+        @param cancellable A Gio.Cancellable to stop the load with
+        @param callback Called as callback(pixbuf, *args) on the main loop,
+                        pixbuf is None if the image could not be loaded
+        """
+        f = Gio.File.new_for_path(path)
+
+        def on_info(f, result):
+            try:
+                info = f.query_info_finish(result)
+            except GLib.GError:
+                callback(None, *args)
+                return
+
+            key = "{}\0{}\0{}\0{}x{}".format(path, info.get_attribute_uint64("time::modified"),
+                                             info.get_size(), width, height)
+            key = hashlib.sha1(key.encode("utf-8")).hexdigest()
+            pixbuf = self._pixbufs.get(key)
+            if pixbuf is not None:
+                callback(pixbuf, *args)
+                return
+
+            png = Gio.File.new_for_path(os.path.join(self._directory, key + ".png"))
+            png.read_async(GLib.PRIORITY_DEFAULT, cancellable, on_png_opened, key)
+
+        def on_png_opened(png, result, key):
+            try:
+                stream = png.read_finish(result)
+            except GLib.GError:
+                # not on disk yet, rasterize the image itself
+                f.read_async(GLib.PRIORITY_DEFAULT, cancellable, on_image_opened, key)
+                return
+            GdkPixbuf.Pixbuf.new_from_stream_async(stream, cancellable,
+                                                   on_loaded, key, False)
+
+        def on_image_opened(f, result, key):
+            try:
+                stream = f.read_finish(result)
+            except GLib.GError:
+                callback(None, *args)
+                return
+            GdkPixbuf.Pixbuf.new_from_stream_at_scale_async(stream, width, height, True,
+                                                            cancellable, on_loaded, key, True)
+
+        def on_loaded(stream, result, key, rasterized):
+            try:
+                pixbuf = GdkPixbuf.Pixbuf.new_from_stream_finish(result)
+            except GLib.GError:
+                if not rasterized:
+                    # a broken cache file, rasterize the image itself
+                    f.read_async(GLib.PRIORITY_DEFAULT, cancellable, on_image_opened, key)
+                else:
+                    callback(None, *args)
+                return
+            stream.close_async(GLib.PRIORITY_DEFAULT, None, None)
+
+            self._pixbufs[key] = pixbuf
+            if rasterized:
+                self._save_async(key, pixbuf)
+            callback(pixbuf, *args)
+
+        f.query_info_async("time::modified,standard::size", Gio.FileQueryInfoFlags.NONE,
+                           GLib.PRIORITY_DEFAULT, cancellable, on_info)
+
+    def _save_async(self, key, pixbuf):
+        try:
+            os.makedirs(self._directory, exist_ok=True)
+        except OSError:
+            return
+
+        def on_saved(pixbuf, result, stream):
+            try:
+                GdkPixbuf.Pixbuf.save_to_stream_finish(result)
+            except GLib.GError as e:
+                print("Failed to write the image cache: {}".format(e.message))
+            stream.close_async(GLib.PRIORITY_DEFAULT, None, None)
+
+        def on_replaced(png, result):
+            try:
+                stream = png.replace_finish(result)
+            except GLib.GError:
+                return
+            # the stream writes to a temporary file which only replaces
+            # the cache file once closed, so readers never see a partial
+            # file
+            pixbuf.save_to_streamv_async(stream, "png", [], [], None, on_saved, stream)
+
+        png = Gio.File.new_for_path(os.path.join(self._directory, key + ".png"))
+        png.replace_async(None, False, Gio.FileCreateFlags.REPLACE_DESTINATION,
+                          GLib.PRIORITY_LOW, None, on_replaced)
@@ -1,69 +1,296 @@
 #!/usr/bin/python3
 # vim: set expandtab shiftwidth=4 tabstop=4
 
-from ratbagd import *
+from .ratbagd import *
+from .devicecache import DeviceCache
+from .imagecache import ImageCache
+from .profilefile import ProfileFile, ProfileFileError
+from .devicestate import stage_writes
+from . import startuptrace
+import collections
 import os
 
 import gi
 gi.require_version('Gio', '2.0')
+gi.require_version('Gdk', '3.0')
 gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk, Gio
+from gi.repository import Gdk, Gtk, Gio, GLib
+
+class WriteScheduler(object):
+    """
+    Coalesces rapid changes from the widgets, e.g. while holding the arrow
+    of a spinbutton. Each change is scheduled under a key and replaces any
+    pending change with the same key; only the latest ones are applied once
+    the widgets were quiet for delay milliseconds or when flush() is
+    called.
+    """
+
+    def __init__(self, delay=300):
+        self._delay = delay
+        self._pending = collections.OrderedDict()
+        self._source = 0
+
+    def schedule(self, key, func, *args):
+        self._pending.pop(key, None)
+        self._pending[key] = (func, args)
+
+        if self._source:
+            GLib.source_remove(self._source)
+        self._source = GLib.timeout_add(self._delay, self._on_timeout)
+
+    def _on_timeout(self):
+        self._source = 0
+        self.flush()
+        return False
+
+    def flush(self):
+        self.cancel()
+        pending = list(self._pending.values())
+        self._pending.clear()
+        for func, args in pending:
+            func(*args)
+
+    def cancel(self):
+        """Stops the timer. Pending changes are kept unless cleared."""
+        if self._source:
+            GLib.source_remove(self._source)
+            self._source = 0
+
+    def clear(self):
+        self.cancel()
+        self._pending.clear()
+
+class ProfilePrefetcher(object):
+    """
+    Creates the resolutions and buttons of the profiles that are not shown
+    while the main loop is idle, one object per iteration, so switching to
+    a profile later does not have to. It runs at low priority, i.e. after
+    the window was drawn, and stops on cancel(), e.g. when the user starts
+    editing so the writes are not delayed.
+    """
+
+    def __init__(self):
+        self._source = 0
+        self._work = None
+
+    def start(self, device, current):
+        self.cancel()
+        self._work = self._objects(device, current.index)
+        self._source = GLib.idle_add(self._on_idle, priority=GLib.PRIORITY_LOW)
+
+    def _objects(self, device, current):
+        profiles = device.profiles
+        for i in range(len(profiles)):
+            if i == current:
+                continue
+            profile = profiles[i]
+            yield
+            # accessing an entry creates it, entries already created are
+            # skipped quickly
+            for objects in (profile.resolutions, profile.buttons):
+                for j in range(len(objects)):
+                    objects[j]
+                    yield
+
+    def _on_idle(self):
+        try:
+            next(self._work)
+            return True
+        except (StopIteration, RatbagdDBusUnavailable):
+            self._source = 0
+            self._work = None
+            return False
+
+    def cancel(self):
+        if self._source:
+            GLib.source_remove(self._source)
+            self._source = 0
+        self._work = None
+
+class SpecialMappings(object):
+    """
+    An index of the special mappings in the model of the custommap combo,
+    column 0 being the label and column 1 the special value. The labels
+    and rows of special values are looked up without walking the model.
+    The model never changes, so the index is built once.
+    """
+
+    def __init__(self, model):
+        self._by_value = {}
+        it = model.get_iter_first()
+        while it:
+            label, value = model[it][0], model[it][1]
+            # the list store's iters stay valid as long as the row exists
+            self._by_value[value] = (label, it)
+            it = model.iter_next(it)
+
+    def label(self, value):
+        """The label of the given special value, or None."""
+        entry = self._by_value.get(value)
+        return entry[0] if entry is not None else None
+
+    def iter(self, value):
+        """The model row of the given special value, or None."""
+        entry = self._by_value.get(value)
+        return entry[1] if entry is not None else None
+
+class KeyNames(object):
+    """
+    Names of evdev keycodes in the current keyboard layout. The keymap is
+    only asked once per keycode, so a macro preview can be rebuilt on
+    every recorded event.
+    """
+
+    # evdev keycodes of the left modifier keys by modifier mask, and the
+    # names of the modifier keycodes
+    MODIFIERS = [
+        (Gdk.ModifierType.CONTROL_MASK, 29),
+        (Gdk.ModifierType.SHIFT_MASK, 42),
+        (Gdk.ModifierType.MOD1_MASK, 56),
+        (Gdk.ModifierType.SUPER_MASK, 125),
+    ]
+    MODIFIER_NAMES = {
+        29: "Ctrl", 97: "Ctrl",
+        42: "Shift", 54: "Shift",
+        56: "Alt", 100: "Alt",
+        125: "Super", 126: "Super",
+    }
+
+    def __init__(self):
+        self._keymap = Gdk.Keymap.get_default()
+        self._names = {}
+        self._keymap.connect("keys-changed", self._on_keys_changed)
+
+    def _on_keys_changed(self, keymap):
+        self._names.clear()
+
+    def name(self, keycode):
+        """The name of the key with the given evdev keycode."""
+        name = self._names.get(keycode)
+        if name is None:
+            # X keycodes are evdev keycodes shifted by 8
+            found, keys, keyvals = self._keymap.get_entries_for_keycode(keycode + 8)
+            if found and keyvals and keyvals[0]:
+                name = Gdk.keyval_name(Gdk.keyval_to_upper(keyvals[0]))
+            if not name:
+                name = "Key {}".format(keycode)
+            self._names[keycode] = name
+        return name
+
+    def key_text(self, keys):
+        """A label for a key mapping, the keycode followed by modifier
+        keycodes, e.g. "Ctrl+Shift+A"."""
+        if not keys or not keys[0]:
+            return "No key"
+        names = [self.MODIFIER_NAMES.get(k) or self.name(k) for k in keys[1:]]
+        names.append(self.name(keys[0]))
+        return "+".join(names)
+
+    def macro_text(self, macro):
+        """A one-line preview of a RatbagdMacro."""
+        text = []
+        for type, value in macro:
+            if type == RatbagdMacro.KEY_PRESS:
+                text.append("\u2193" + self.name(value))
+            elif type == RatbagdMacro.KEY_RELEASE:
+                text.append("\u2191" + self.name(value))
+            elif type == RatbagdMacro.WAIT:
+                text.append("{}ms".format(value))
+        return " ".join(text)
 
 class Piper(Gtk.Window):
 
     def _show_error(self, message):
-        box = self._builder.get_object("piper-error-box")
+        child = self.get_child()
+        if child is not None:
+            self.remove(child)
 
-        btn = self._builder.get_object("piper-error-button")
-        btn.connect("clicked", Gtk.main_quit)
+        box = self._builder.get_object("piper-error-box")
 
         error = self._builder.get_object("piper-error-body-label")
         error.set_text(message)
 
         self.add(box)
         self.show()
+        self._set_device_actions_sensitive(False)
+
+    def _set_device_actions_sensitive(self, sensitive):
+        # the header bar actions all work on the shown device
+        for button in self._device_actions:
+            button.set_sensitive(sensitive)
 
     def _show_btnmap_dialog(self, button):
         dialog = self._builder.get_object("piper-btnmap-dialog")
         dialog.set_transient_for(self)
 
+        # handlers are disconnected again when the dialog closes, otherwise
+        # they would keep writing to the previous buttons
+        handlers = []
+
+        # the key and macro are edited in copies and written as a whole,
+        # they must be set before the radio buttons may write them
+        self._key = list(button.key or [])
+        self._macro = button.macro.copy()
+
         sb = self._builder.get_object("piper-btnmap-btnmap-spinbutton")
-        sb.connect("value-changed", self.on_btnmap_changed, button)
+        handlers.append((sb, sb.connect("value-changed", self.on_btnmap_changed, button)))
+        handlers.append((sb, sb.connect("focus-out-event", self.on_focus_out)))
 
         c = self._builder.get_object("piper-btnmap-custommap-combo")
         # select the currently selected function
-        tree = c.get_model()
-        it = tree.get_iter_first()
-        while it:
-            v = button.special
-            if tree.get_value(it, 1) == v:
-                c.set_active_iter(it)
-                break;
-            it = tree.iter_next(it)
+        it = self._specials.iter(button.special)
         if it == None:
-            c.set_active_iter(tree.get_iter_first())
+            it = c.get_model().get_iter_first()
+        c.set_active_iter(it)
 
-        c.connect("changed", self.on_custommap_changed, button)
+        handlers.append((c, c.connect("changed", self.on_custommap_changed, button)))
 
         radio = self._builder.get_object("piper-btnmap-btnmap-radio")
-        radio.connect("toggled", self.on_actiontype_changed_button, button)
+        handlers.append((radio, radio.connect("toggled", self.on_actiontype_changed_button, button)))
         radio.set_active(button.action_type == "button")
 
         radio = self._builder.get_object("piper-btnmap-keymap-radio")
-        radio.connect("toggled", self.on_actiontype_changed_key, button)
+        handlers.append((radio, radio.connect("toggled", self.on_actiontype_changed_key, button)))
         radio.set_active(button.action_type == "key")
 
+        self._builder.get_object("piper-btnmap-keymap-label").set_text(self._key_names.key_text(self._key))
+        keybutton = self._builder.get_object("piper-btnmap-keymap-button")
+        keybutton.set_active(False)
+        handlers.append((keybutton, keybutton.connect("toggled", self.on_keymap_toggled)))
+        handlers.append((dialog, dialog.connect("key-press-event", self.on_keymap_key_event, button)))
+
         radio = self._builder.get_object("piper-btnmap-keyseqmap-radio")
-        radio.connect("toggled", self.on_actiontype_changed_macro, button)
+        handlers.append((radio, radio.connect("toggled", self.on_actiontype_changed_macro, button)))
         radio.set_active(button.action_type == "macro")
 
+        self._update_macro_label()
+        record = self._builder.get_object("piper-btnmap-macro-record-button")
+        record.set_active(False)
+        handlers.append((record, record.connect("toggled", self.on_macro_record_toggled, button)))
+        handlers.append((dialog, dialog.connect("key-press-event", self.on_macro_key_event, True)))
+        handlers.append((dialog, dialog.connect("key-release-event", self.on_macro_key_event, False)))
+        for name, edit in (("trim", RatbagdMacro.remove_last),
+                           ("nodelay", RatbagdMacro.remove_delays),
+                           ("clear", RatbagdMacro.clear)):
+            b = self._builder.get_object("piper-btnmap-macro-{}-button".format(name))
+            handlers.append((b, b.connect("clicked", self.on_macro_edited, button, edit)))
+
         radio = self._builder.get_object("piper-btnmap-custommap-radio")
-        radio.connect("toggled", self.on_actiontype_changed_special, button)
+        handlers.append((radio, radio.connect("toggled", self.on_actiontype_changed_special, button)))
         radio.set_active(button.action_type == "special")
 
         response = dialog.run()
 
+        # closing the dialog ends a recording and writes it
+        record.set_active(False)
+        keybutton.set_active(False)
+        for widget, handler in handlers:
+            widget.disconnect(handler)
+        self._writes.flush()
+
+        self._disconnect_signals()
         self._update_from_device()
+        self._connect_signals()
 
         dialog.hide()
 
@@ -73,47 +300,84 @@ class Piper(Gtk.Window):
         main_window.add_from_resource("/org/freedesktop/Piper/piper.ui")
         self._builder = main_window;
         self._signal_ids = []
+        self._notify_ids = []
+        self._writes = WriteScheduler()
+        self._prefetch = ProfilePrefetcher()
         self._initialized = False
         self._button_function_labels = []
-
-        self._ratbag_device = self._fetch_ratbag_device()
-        if self._ratbag_device == None:
-            return
-
+        self._button_rows = []
         self._profile_buttons = []
-        self._current_profile = self._ratbag_device.active_profile
-
+        self._profile_box = None
+        self._profile_enabled = None
+        self._transactions = {}
+        self._transaction = None
+        combo = main_window.get_object("piper-btnmap-custommap-combo")
+        self._specials = SpecialMappings(combo.get_model())
+        # the error page may be shown several times, connect it only once
+        main_window.get_object("piper-error-button").connect("clicked", Gtk.main_quit)
+        self._key_names = KeyNames()
+        self._key = []
+        self._macro = RatbagdMacro()
+        self._macro_label_source = 0
+        self._ratbag_device = None
+        self._device_path = None
+        self._device_cache = DeviceCache()
+        self._image_cache = ImageCache()
+        self._image_cancellable = None
+        self._loaded_devices = {}
+        # device ids by object path, as listed at startup and on hotplug
+        self._device_ids = {}
+
+        self.connect("delete-event", self.on_delete_event)
+
+        self._init_header()
+        self._init_report_rate(main_window)
+        self._init_resolution(main_window)
+        lb = main_window.get_object("piper-buttons-listbox")
+        lb.remove(main_window.get_object("piper-button-listboxrow"))
         grid = main_window.get_object("piper-grid")
-        self._init_header(self._ratbag_device)
+        grid.set_sensitive(False)
         self.add(grid)
 
-        # load the right image
-        svg = self._ratbag_device.svg_path
-        img = main_window.get_object("piper-image-device")
-        if not os.path.isfile(svg):
-            img.set_from_resource("/org/freedesktop/Piper/404.svg")
-        else:
-            img.set_from_file(svg)
-
-        # init the current profile's data
-        p = self._current_profile
-        self._init_report_rate(main_window, p)
-        self._init_resolution(main_window, p)
-        self._init_buttons(main_window, p)
+        # Show the window frame first, ratbagd is only queried and the
+        # first device only loaded once the frame is drawn
+        self._ratbag = None
+        self._draw_id = self.connect("draw", self.on_first_draw)
+        self.show()
+        startuptrace.mark("window-shown")
+
+    def on_first_draw(self, widget, cr):
+        self.disconnect(self._draw_id)
+        startuptrace.mark("first-frame")
+        GLib.idle_add(self._init_ratbag)
+        return False
+
+    def _init_ratbag(self):
+        self._ratbag = self._fetch_ratbag()
+        startuptrace.mark("ratbagd-connected")
+        if self._ratbag == None:
+            startuptrace.finish()
+            return False
+
+        # devices are only loaded once selected, the list only needs their
+        # descriptions and is kept up to date on hotplug
+        self._ratbag.connect("device-added", self.on_device_added)
+        self._ratbag.connect("device-removed", self.on_device_removed)
+        # the first device is selected once its id is known, so it can be
+        # shown from the device cache
+        self._add_device_entries(self._ratbag.devices.object_paths)
 
-        self._update_from_device()
-        self._connect_signals()
         self._initialized = True
+        return False
 
-        self.connect("delete-event", Gtk.main_quit)
-        self.show()
-
-    def  _init_header(self, device):
+    def  _init_header(self):
         hb = Gtk.HeaderBar()
         hb.set_show_close_button(True)
-        hb.props.title = "{}".format(device.name)
+        self._headerbar = hb
         self.set_titlebar(hb)
 
+        self._device_actions = []
+
         # apply/reset buttons
         box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
         Gtk.StyleContext.add_class(box.get_style_context(), "linked")
@@ -124,6 +388,7 @@ class Piper(Gtk.Window):
         button.add(image)
         button.connect("clicked", self.on_button_reset_clicked)
         box.add(button)
+        self._device_actions.append(button)
 
         button = Gtk.Button()
         icon = Gio.ThemedIcon(name="document-save-symbolic")
@@ -131,29 +396,78 @@ class Piper(Gtk.Window):
         button.add(image)
         button.connect("clicked", self.on_button_save_clicked)
         box.add(button)
+        self._device_actions.append(button)
 
         hb.pack_end(box)
 
-        # Profile buttons
+        # import/export of profile files
+        box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        Gtk.StyleContext.add_class(box.get_style_context(), "linked")
+
+        button = Gtk.Button()
+        icon = Gio.ThemedIcon(name="document-open-symbolic")
+        image = Gtk.Image.new_from_gicon(icon, Gtk.IconSize.BUTTON)
+        button.add(image)
+        button.set_tooltip_text("Import profiles")
+        button.connect("clicked", self.on_button_import_clicked)
+        box.add(button)
+        self._device_actions.append(button)
+
+        button = Gtk.Button()
+        icon = Gio.ThemedIcon(name="document-save-as-symbolic")
+        image = Gtk.Image.new_from_gicon(icon, Gtk.IconSize.BUTTON)
+        button.add(image)
+        button.set_tooltip_text("Export profiles")
+        button.connect("clicked", self.on_button_export_clicked)
+        box.add(button)
+        self._device_actions.append(button)
+
+        hb.pack_end(box)
+
+        # Device switcher
+        combo = Gtk.ComboBoxText()
+        combo.connect("changed", self.on_device_changed)
+        self._device_combo = combo
+        hb.pack_start(combo)
+
+        hb.show_all()
+        # the window is shown before ratbagd is asked for a device
+        self._set_device_actions_sensitive(False)
+
+    def _init_profile_buttons(self, device):
+        if self._profile_box is not None:
+            self._profile_box.destroy()
+            self._profile_box = None
+        if self._profile_enabled is not None:
+            self._profile_enabled.destroy()
+            self._profile_enabled = None
+        self._profile_buttons = []
+
         profiles = device.profiles
         if len(profiles) > 1:
             box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
             Gtk.StyleContext.add_class(box.get_style_context(), "linked")
 
-            for i, p in enumerate(profiles):
+            for i in range(len(profiles)):
                 button = Gtk.ToggleButton("Profile {}".format(i))
                 box.add(button)
                 self._profile_buttons.append(button)
-            hb.pack_start(box)
-
-        hb.show_all()
-
-    def _fetch_ratbag_device(self):
+            self._headerbar.pack_start(box)
+            box.show_all()
+            self._profile_box = box
+
+            # only offered where ratbagd would accept it
+            if device.has_capability(RatbagdDevice.CAP_DISABLE_PROFILE):
+                check = Gtk.CheckButton("Enabled")
+                check.set_tooltip_text("Disabled profiles are skipped when switching profiles on the device")
+                self._headerbar.pack_start(check)
+                check.show()
+                self._profile_enabled = check
+
+    def _fetch_ratbag(self):
         """
-        Get the first ratbag device available. If there are multiple
-        devices, an error message is printed and we default to the first
-        one.
-        Otherwise, an error is shown and we return None.
+        Connect to ratbagd. If ratbagd is not available or there are no
+        devices, an error is shown and we return None.
         """
         try:
             ratbag = Ratbagd()
@@ -167,23 +481,209 @@ class Piper(Gtk.Window):
             self._show_error("Could not find any devices. Do you have anything vaguely mouse-looking plugged in?")
             return None
 
-        if len(ratbag.devices) > 1:
-            print("Ooops, can't deal with more than one device. My bad.")
-            for d in ratbag.devices[1:]:
-                print("Ignoring device {}".format(d.name))
+        return ratbag
+
+    def _add_device_entries(self, paths):
+        # the ids and descriptions are filled in once ratbagd replied, all
+        # of them are asked for in one batch
+        for path in paths:
+            self._device_combo.append(path, os.path.basename(path))
+        self._ratbag.get_device_properties_async(paths, ["Id", "Description"],
+                                                 self._on_device_properties, paths)
+
+    def _on_device_properties(self, values, paths):
+        for path, (device_id, description) in zip(paths, values):
+            self._device_ids[path] = device_id
+            i = self._device_combo_position(path)
+            if i >= 0 and description is not None:
+                self._device_combo.get_model()[i][0] = description
+
+        if self._device_path is None and self._device_combo.get_active() < 0:
+            self._device_combo.set_active(0)
+
+    def _device_combo_position(self, path):
+        for i, row in enumerate(self._device_combo.get_model()):
+            if row[1] == path:
+                return i
+        return -1
+
+    def on_device_added(self, ratbag, path):
+        # selected once its id is known if no device is shown
+        self._add_device_entries([path])
+
+    def on_device_removed(self, ratbag, path):
+        self._transactions.pop(path, None)
+        self._device_ids.pop(path, None)
+        self._loaded_devices.pop(path, None)
+        i = self._device_combo_position(path)
+        if i >= 0:
+            self._device_combo.remove(i)
+
+        if path != self._device_path:
+            return
+
+        self._clear_device()
+        if len(self._ratbag.devices) > 0:
+            self._device_combo.set_active(0)
+        else:
+            self._show_error("Could not find any devices. Do you have anything vaguely mouse-looking plugged in?")
+
+    def _clear_device(self):
+        self._writes.clear()
+        self._prefetch.cancel()
+        self._disconnect_signals()
+        self._unwatch_profile()
+        self._ratbag_device = None
+        self._device_path = None
+        self._current_profile = None
+        self._set_device_actions_sensitive(False)
+
+    def on_device_changed(self, combo):
+        path = combo.get_active_id()
+        if path is None or path == self._device_path:
+            return
+
+        # ratbagd may have gone away since the device was listed, this is a
+        # signal handler so nothing above would catch it
+        try:
+            self._select_device(path)
+        except RatbagdDBusUnavailable:
+            self._loaded_devices.pop(path, None)
+            self._clear_device()
+            self._show_error("Can't connect to ratbagd on DBus. That's quite unfortunate.")
 
-        d = ratbag.devices[0]
+    def _select_device(self, path):
+        # Show a device seen before from its cached state right away, it is
+        # validated against ratbagd in the background once shown
+        cached = None
+        if path not in self._loaded_devices:
+            cached = self._device_cache.lookup(self._device_ids.get(path), path)
+            if cached is not None and RatbagdDevice.preload_state(cached[1]) is not None:
+                cached = None
+
+        devices = self._ratbag.devices
+        d = devices[devices.object_paths.index(path)]
+        if path not in self._loaded_devices:
+            self._loaded_devices[path] = d
+            if cached is None:
+                self._device_cache.store(path, d)
         p = d.profiles
         if len(p) == 1 and len(p[0].resolutions) == 1:
-            self._show_error("Device {} does not support switchable resolutions".format(d.name))
-            return None
+            print("Device {} does not support switchable resolutions".format(d.description))
+            if len(devices) == 1:
+                self._show_error("Device {} does not support switchable resolutions".format(d.description))
+                return
+
+        self._set_device(path, d)
+        if cached is not None:
+            d.refresh_async(self._on_device_validated, path, d, cached)
+
+    def _on_device_validated(self, error, path, device, cached):
+        if error is not None:
+            print("Failed to update {} from ratbagd: {}".format(path, error.message))
+            return
 
-        return d
+        # The changed properties already updated the widgets through
+        # notify, unless the profiles, resolutions or buttons changed.
+        # Values staged in the device's transaction are kept by the
+        # refresh, only the changes of objects that are gone are dropped.
+        cached_id, state = cached
+        if device.id != cached_id:
+            self._device_cache.remove(cached_id)
+        new_state = device.get_state()
+        if set(new_state.keys()) != set(state.keys()):
+            transaction = self._transactions.get(path)
+            if transaction is not None:
+                transaction.prune(new_state.keys())
+            if path == self._device_path:
+                self._set_device(path, device)
+        self._device_cache.store(path, device)
+
+    def on_delete_event(self, window, event):
+        for path, device in self._loaded_devices.items():
+            self._device_cache.store(path, device)
+        Gtk.main_quit()
+
+    def _set_device(self, path, device):
+        """
+        Show the given device. Its profiles, resolutions and buttons are
+        only loaded now, so devices that are never selected cost nothing.
+        """
+        self._writes.flush()
+        self._disconnect_signals()
 
-    def _init_resolution(self, builder, profile):
-        res = profile.resolutions
-        nres = len(profile.resolutions)
+        self._ratbag_device = device
+        self._device_path = path
+        self._current_profile = device.active_profile
+        self._set_device_actions_sensitive(True)
+
+        # All changes are staged until the save button is clicked, each
+        # device keeps its own pending changes
+        if path not in self._transactions:
+            self._transactions[path] = device.transaction()
+        self._transaction = self._transactions[path]
+
+        # a previous device may have been removed with an error shown
+        grid = self._builder.get_object("piper-grid")
+        grid.set_sensitive(True)
+        if self.get_child() is not grid:
+            child = self.get_child()
+            if child is not None:
+                self.remove(child)
+            self.add(grid)
+
+        self._headerbar.props.title = "{}".format(device.description)
+        self._init_profile_buttons(device)
+
+        # init the current profile's data, the button rows and the image
+        # follow once the rest is drawn
+        p = self._current_profile
+        self._update_from_device()
+        self._watch_profile(p)
+        self._connect_signals()
+        startuptrace.mark("device-shown")
+
+        GLib.idle_add(self._init_buttons_idle, device)
+        self._load_device_image(device)
+
+        # warm up the other profiles once the window is drawn
+        self._prefetch.start(device, p)
+
+    def _init_buttons_idle(self, device):
+        if device is self._ratbag_device:
+            self._init_buttons(self._builder, self._current_profile)
+            startuptrace.mark("button-rows")
+        return False
+
+    def _load_device_image(self, device):
+        # the placeholder is shown until the image is loaded and decoded
+        # in the background, or if there is none
+        if self._image_cancellable is not None:
+            self._image_cancellable.cancel()
+        img = self._builder.get_object("piper-image-device")
+        img.set_from_resource("/org/freedesktop/Piper/404.svg")
+
+        if not device.svg_path:
+            self._on_device_image_loaded(None, device)
+            return
 
+        self._image_cancellable = Gio.Cancellable()
+        width = img.get_property("width-request")
+        self._image_cache.load_async(device.svg_path, width, -1,
+                                     self._image_cancellable,
+                                     self._on_device_image_loaded, device)
+
+    def _on_device_image_loaded(self, pixbuf, device):
+        if device is not self._ratbag_device:
+            return
+
+        if pixbuf is not None:
+            img = self._builder.get_object("piper-image-device")
+            img.set_from_pixbuf(pixbuf)
+        startuptrace.mark("device-image")
+        startuptrace.finish()
+
+    def _init_resolution(self, builder):
         self._resolution_buttons = []
         self._resolution_adjustments = []
         for i in range(0, 5):
@@ -194,40 +694,85 @@ class Piper(Gtk.Window):
 
         nres_spin = builder.get_object("piper-nresolutions-spin")
         self._nres_button = nres_spin
-        nres_spin.set_range(1, nres)
 
-    def _init_report_rate(self, builder, profile):
-        # Note: we simplify here, the UI only allows one report rate and it
-        # will be applied to all resolutions
-        rate = profile.active_resolution.report_rate
+        # A row for the Y resolutions below the X ones, only shown for
+        # resolutions with CAP_SEPARATE_XY_RESOLUTION
+        self._xres_label = builder.get_object("piper-xres-label")
+        self._yres_buttons = []
+        self._separate_xy = [False] * 5
+        box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        box.set_valign(Gtk.Align.CENTER)
+        box.set_margin_bottom(10)
+        label = Gtk.Label("Y resolutions")
+        label.set_margin_left(12)
+        label.set_margin_top(8)
+        label.set_margin_bottom(8)
+        label.set_hexpand(True)
+        label.set_xalign(0)
+        box.add(label)
+        for i in range(0, 5):
+            adj = Gtk.Adjustment(lower=50, upper=12000, step_increment=50,
+                                 page_increment=500)
+            sb = Gtk.SpinButton(adjustment=adj, climb_rate=50,
+                                orientation=Gtk.Orientation.VERTICAL)
+            box.add(sb)
+            self._yres_buttons.append(sb)
+        box.show_all()
+
+        row = Gtk.ListBoxRow()
+        row.set_activatable(False)
+        row.set_selectable(False)
+        row.add(box)
+        lb = builder.get_object("piper-resolutions-listbox")
+        lb.insert(row, builder.get_object("piper-listboxrow-xres").get_index() + 1)
+        self._yres_row = row
+
+    def _init_report_rate(self, builder):
+        # Note: ratbagd does not list the rates a device supports, so the
+        # common USB polling rates are offered. The rate applies to the
+        # active resolution if it has its own, see
+        # on_resolution_rate_changed().
         r500 = builder.get_object("piper-report-rate-500")
         r1000 = builder.get_object("piper-report-rate-1000")
-        r500.connect("toggled", self.on_resolution_rate_changed, 500)
-        r1000.connect("toggled", self.on_resolution_rate_changed, 1000)
+        box = builder.get_object("piper-rate-box")
+        self._rate_label = builder.get_object("piper-rate-label")
 
         self._rate_buttons = { 500 : r500,
                                1000 : r1000 }
+        for i, rate in enumerate((125, 250)):
+            b = Gtk.RadioButton.new_with_label_from_widget(r500, "{}Hz".format(rate))
+            box.pack_start(b, False, True, 0)
+            # after the label, before 500Hz
+            box.reorder_child(b, i + 1)
+            b.show()
+            self._rate_buttons[rate] = b
 
     def _init_buttons(self, builder, profile):
-        lb = builder.get_object("piper-buttons-listbox")
-        lb.remove(builder.get_object("piper-button-listboxrow"))
-
-        for i, b in enumerate(profile.buttons):
-            lbr = self._init_button_row(b)
-            lb.add(lbr)
+        # The rows are kept for the lifetime of the window and refer to
+        # their button by index, so switching profiles or devices only
+        # updates the labels. Rows are only added if a device has more
+        # buttons than any device before.
+        nbuttons = len(profile.buttons)
+        if len(self._button_rows) < nbuttons:
+            lb = builder.get_object("piper-buttons-listbox")
+            for i in range(len(self._button_rows), nbuttons):
+                lbr = self._init_button_row(i)
+                lb.add(lbr)
+                lbr.show_all()
+                self._button_rows.append(lbr)
+
+        for i, lbr in enumerate(self._button_rows):
+            lbr.set_visible(i < nbuttons)
 
         self._set_button_row_function_labels(profile)
 
-        lb.show_all()
-
-    def _init_button_row(self, button):
-        # FIXME: can't I duplicate this from builder?
+    def _init_button_row(self, index):
         lbr = Gtk.ListBoxRow()
         lbr.height_request = 80
         lbr.width_request = 100
         box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
         l1 = Gtk.Label()
-        l1.set_markup("<b>Button {}</b>".format(button.index))
+        l1.set_markup("<b>Button {}</b>".format(index))
         l1.set_margin_left(12)
         l1.set_margin_top(8)
         l1.set_margin_bottom(8)
@@ -243,7 +788,7 @@ class Piper(Gtk.Window):
         self._button_function_labels.append(l2)
 
         btn = Gtk.Button("...")
-        btn.connect("clicked", self.on_button_click, button)
+        btn.connect("clicked", self.on_button_click, index)
         box.add(btn)
         lbr.add(box)
         return lbr
@@ -251,31 +796,83 @@ class Piper(Gtk.Window):
     def _set_button_row_function_labels(self, profile):
         buttons = profile.buttons
         for l, button in zip(self._button_function_labels, buttons):
-            action = button.action_type
-            if action == "button":
-                text = "Button {} click".format(button.button)
-            elif action == "key":
-                text = "Key event: {}".format(button.key[0])
-            elif action == "macro":
-                text = "Macro (unsupported, sorry)"
-            elif action == "special":
-                v = button.special
-                c = self._builder.get_object("piper-btnmap-custommap-combo")
-                tree = c.get_model()
-                it = tree.get_iter_first()
-                while it:
-                    if tree.get_value(it, 1) == v:
-                        text = "{}".format(tree[it][0])
-                        break;
-                    it = tree.iter_next(it)
-
-                if it == None:
-                    text = "Unknown special {}".format(v)
+            self._set_button_row_function_label(l, button)
+
+    def _set_button_row_function_label(self, l, button):
+        action = button.action_type
+        if action == "button":
+            text = "Button {} click".format(button.button_mapping)
+        elif action == "key":
+            text = "Key event: {}".format(self._key_names.key_text(button.key))
+        elif action == "macro":
+            text = "Macro: {}".format(self._key_names.macro_text(button.macro))
+        elif action == "special":
+            v = button.special
+            label = self._specials.label(v)
+            if label is not None:
+                text = "{}".format(label)
             else:
-                text = "!help, I'm confused!"
+                text = "Unknown special {}".format(v)
+        else:
+            text = "!help, I'm confused!"
 
-            l.set_text(text)
+        l.set_text(text)
 
+    def _unwatch_profile(self):
+        for obj, s in self._notify_ids:
+            obj.disconnect(s)
+        self._notify_ids = []
+
+    def _watch_profile(self, profile):
+        """
+        Listen to property changes of the profile's resolutions and buttons
+        so that only the affected widgets are updated when ratbagd reports
+        a change.
+        """
+        self._unwatch_profile()
+
+        s = []
+        s.append((profile, profile.connect("notify::active-resolution", self.on_active_resolution_notify)))
+        s.append((profile, profile.connect("notify::enabled", self.on_profile_enabled_notify)))
+        for i, r in enumerate(profile.resolutions):
+            # only as many resolutions as there are spin buttons are shown
+            if i < len(self._resolution_buttons):
+                s.append((r, r.connect("notify::resolution", self.on_resolution_notify, i)))
+            s.append((r, r.connect("notify::report-rate", self.on_report_rate_notify)))
+        for i, b in enumerate(profile.buttons):
+            for prop in ("action-type", "button-mapping", "special", "key", "macro"):
+                s.append((b, b.connect("notify::{}".format(prop), self.on_button_notify, i)))
+        self._notify_ids = s
+
+    def on_active_resolution_notify(self, profile, pspec):
+        self._disconnect_signals()
+        self._update_capabilities(profile)
+        self._update_report_rate(profile)
+        self._connect_signals()
+
+    def on_report_rate_notify(self, resolution, pspec):
+        if resolution == self._current_profile.active_resolution:
+            self.on_active_resolution_notify(self._current_profile, pspec)
+
+    def on_profile_enabled_notify(self, profile, pspec):
+        if self._profile_enabled is None:
+            return
+        self._disconnect_signals()
+        self._profile_enabled.set_active(profile.enabled)
+        self._connect_signals()
+
+    def on_resolution_notify(self, resolution, pspec, index):
+        self._disconnect_signals()
+        self._resolution_buttons[index].set_value(resolution.resolution[0])
+        self._yres_buttons[index].set_value(resolution.resolution[1])
+        self._adjust_sensitivity_ranges()
+        self._connect_signals()
+
+    def on_button_notify(self, button, pspec, index):
+        # the rows may not be built yet, they start with the current labels
+        if index >= len(self._button_function_labels):
+            return
+        self._set_button_row_function_label(self._button_function_labels[index], button)
 
     def _connect_signals(self):
         """
@@ -286,52 +883,187 @@ class Piper(Gtk.Window):
         """
         s = []
         for i, b in enumerate(self._resolution_buttons):
-            s.append(b.connect("value-changed", self.on_resolutions_changed, i))
+            s.append((b, b.connect("value-changed", self.on_resolutions_changed, i)))
+            s.append((b, b.connect("focus-out-event", self.on_focus_out)))
+        for i, b in enumerate(self._yres_buttons):
+            s.append((b, b.connect("value-changed", self.on_yresolutions_changed, i)))
+            s.append((b, b.connect("focus-out-event", self.on_focus_out)))
 
-        s.append(self._nres_button.connect("value-changed", self.on_nresolutions_changed, self._builder))
+        s.append((self._nres_button, self._nres_button.connect("value-changed", self.on_nresolutions_changed, self._builder)))
+
+        for rate, b in self._rate_buttons.items():
+            s.append((b, b.connect("toggled", self.on_resolution_rate_changed, rate)))
 
         for i, b in enumerate(self._profile_buttons):
-            s.append(b.connect("toggled", self.on_button_profile_toggled, i))
+            s.append((b, b.connect("toggled", self.on_button_profile_toggled, i)))
 
-        self._signal_ids = []
+        if self._profile_enabled is not None:
+            b = self._profile_enabled
+            s.append((b, b.connect("toggled", self.on_profile_enabled_toggled)))
+
+        self._signal_ids = s
 
     def _disconnect_signals(self):
         """
         Disconnect all previously connected signals.
         """
-        for s in self._signal_ids:
-            self.disconnect(s)
+        for widget, s in self._signal_ids:
+            widget.disconnect(s)
         self._signal_ids = []
 
+    def _schedule_write(self, key, func, *args):
+        # the user is editing, don't compete with the writes
+        self._prefetch.cancel()
+        self._writes.schedule(key, func, *args)
+
+    def on_focus_out(self, widget, event):
+        self._writes.flush()
+        return False
+
     def on_resolution_rate_changed(self, widget, new_rate):
         if not widget.get_active():
             return
 
-        res = self._current_profile.active_resolution.report_rate = new_rate
+        profile = self._current_profile
+        res = profile.active_resolution if profile is not None else None
+        if res is None:
+            return
+        if res.has_capability(RatbagdResolution.CAP_INDIVIDUAL_REPORT_RATE):
+            targets = [res]
+        else:
+            # the device has one rate, keep all resolutions in sync
+            targets = profile.resolutions
+        for r in targets:
+            self._schedule_write(("report-rate", id(r)),
+                                 setattr, r, "report_rate", new_rate)
 
     def on_nresolutions_changed(self, widget, builder):
         nres = widget.get_value_as_int()
         for i in range(0, 5):
             sb = builder.get_object("piper-xres-spinbutton{}".format(i + 1))
             sb.set_sensitive(nres > i)
+            self._yres_buttons[i].set_sensitive(nres > i and self._separate_xy[i])
 
         self._adjust_sensitivity_ranges()
 
     def on_resolutions_changed(self, widget, index):
         self._adjust_sensitivity_ranges()
-        value = widget.get_value()
-        self._current_profile.resolutions[index].resolution = (value, value)
+        self._write_resolution(index)
+
+    def on_yresolutions_changed(self, widget, index):
+        self._write_resolution(index)
+
+    def _write_resolution(self, index):
+        xres = self._resolution_buttons[index].get_value_as_int()
+        if self._separate_xy[index]:
+            yres = self._yres_buttons[index].get_value_as_int()
+        else:
+            yres = xres
+        res = self._current_profile.resolutions[index]
+        self._schedule_write(("resolution", id(res)),
+                             setattr, res, "resolution", (xres, yres))
+
+    def on_profile_enabled_toggled(self, widget):
+        profile = self._current_profile
+        self._schedule_write(("enabled", id(profile)),
+                             setattr, profile, "enabled", widget.get_active())
 
     def on_button_save_clicked(self, widget):
-        print("FIXME: I should save this to the device now")
+        if self._ratbag_device is None:
+            return
+        self._writes.flush()
+        # don't block the UI while the device is written, the objects of
+        # failed calls are reset and notify the widgets themselves
+        self._transaction.commit_async(self._on_commit_done)
+        self._transaction = self._ratbag_device.transaction()
+        self._transactions[self._device_path] = self._transaction
+
+    def _on_commit_done(self, failed):
+        for obj, method, error in failed:
+            print("Failed to {} on the device: {}".format(method, error.message))
+
+    def _run_file_chooser(self, title, action, button):
+        dialog = Gtk.FileChooserDialog(title, self, action,
+                                       (Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
+                                        button, Gtk.ResponseType.ACCEPT))
+        dialog.set_do_overwrite_confirmation(True)
+        file_filter = Gtk.FileFilter()
+        file_filter.set_name("Piper profiles")
+        file_filter.add_pattern("*.json")
+        dialog.add_filter(file_filter)
+        if action == Gtk.FileChooserAction.SAVE:
+            dialog.set_current_name("{}.json".format(self._ratbag_device.description))
+
+        response = dialog.run()
+        path = dialog.get_filename()
+        dialog.destroy()
+        return path if response == Gtk.ResponseType.ACCEPT else None
+
+    def on_button_export_clicked(self, widget):
+        if self._ratbag_device is None:
+            return
+        path = self._run_file_chooser("Export profiles", Gtk.FileChooserAction.SAVE, "_Save")
+        if path is None:
+            return
+
+        # exports the device state, not the unsaved changes
+        try:
+            ProfileFile.from_device(self._ratbag_device).save(path)
+        except OSError as e:
+            print("Failed to write {}: {}".format(path, e))
+
+    def on_button_import_clicked(self, widget):
+        if self._ratbag_device is None:
+            return
+        path = self._run_file_chooser("Import profiles", Gtk.FileChooserAction.OPEN, "_Open")
+        if path is None:
+            return
+
+        try:
+            profile = ProfileFile.load(path)
+        except (OSError, ProfileFileError) as e:
+            print("Failed to read {}: {}".format(path, e))
+            return
+
+        device = self._ratbag_device
+        if not profile.matches(device):
+            print("{} is for {}, not {}".format(path, profile.description, device.description))
+            return
+
+        # the file replaces any unsaved changes and is written right away,
+        # the widgets follow the device through notify
+        self._writes.clear()
+        self._transaction.rollback()
+        self._transaction = device.transaction()
+        self._transactions[self._device_path] = self._transaction
+        try:
+            stage_writes(self._transaction, profile.writes(device))
+        except ValueError as e:
+            print("Cannot import {}: {}".format(path, e))
+            self._transaction.rollback()
+            self._transaction = device.transaction()
+            self._transactions[self._device_path] = self._transaction
+            return
+        self.on_button_save_clicked(widget)
 
     def on_button_reset_clicked(self, widget):
+        if self._ratbag_device is None:
+            return
+        self._writes.clear()
+        self._transaction.rollback()
+        self._ratbag_device.refresh()
+        self._transaction = self._ratbag_device.transaction()
+        self._transactions[self._device_path] = self._transaction
+
+        self._disconnect_signals()
         self._update_from_device()
+        self._connect_signals()
 
     def on_button_profile_toggled(self, widget, idx):
         if not widget.get_active():
             return
 
+        self._writes.flush()
         self._disconnect_signals()
 
         for b in self._profile_buttons:
@@ -340,16 +1072,20 @@ class Piper(Gtk.Window):
 
         self._current_profile = self._ratbag_device.profiles[idx]
         self._update_from_device()
+        self._watch_profile(self._current_profile)
+        self._prefetch.start(self._ratbag_device, self._current_profile)
 
         if self._initialized:
             self._connect_signals()
 
-    def on_button_click(self, widget, button):
-        self._show_btnmap_dialog(button)
+    def on_button_click(self, widget, index):
+        self._prefetch.cancel()
+        self._show_btnmap_dialog(self._current_profile.buttons[index])
 
     def on_btnmap_changed(self, widget, button):
         b = self._builder.get_object("piper-btnmap-btnmap-spinbutton").get_value_as_int()
-        button.button = b
+        self._schedule_write(("mapping", id(button)),
+                             setattr, button, "button_mapping", b)
 
     def _custommap_combo_value(self):
         combo = self._builder.get_object("piper-btnmap-custommap-combo")
@@ -366,29 +1102,125 @@ class Piper(Gtk.Window):
 
         val = self._custommap_combo_value()
         if val:
-            button.special = val
+            self._schedule_write(("mapping", id(button)),
+                                 setattr, button, "special", val)
 
     def on_actiontype_changed_button(self, widget, button):
         if not widget.get_active():
             return
 
         b = self._builder.get_object("piper-btnmap-btnmap-spinbutton").get_value_as_int()
-        button.button = b
+        self._schedule_write(("mapping", id(button)),
+                             setattr, button, "button_mapping", b)
 
     def on_actiontype_changed_key(self, widget, button):
         if not widget.get_active():
             return
-        print("FIXME: change to key")
+        self._write_key(button)
+
+    def _write_key(self, button):
+        # without a key yet, the mapping is written once one is pressed
+        if not self._key or not self._key[0]:
+            return
+        try:
+            button.check_mapping("key", self._key)
+        except ValueError as e:
+            print(e)
+            return
+        self._schedule_write(("mapping", id(button)),
+                             setattr, button, "key", list(self._key))
+
+    def on_keymap_toggled(self, widget):
+        if widget.get_active():
+            # the macro recorder and this share the key events
+            self._builder.get_object("piper-btnmap-macro-record-button").set_active(False)
+            self._builder.get_object("piper-btnmap-keymap-label").set_text("Press a key\u2026")
+        else:
+            self._builder.get_object("piper-btnmap-keymap-label").set_text(self._key_names.key_text(self._key))
+
+    def on_keymap_key_event(self, widget, event, button):
+        keybutton = self._builder.get_object("piper-btnmap-keymap-button")
+        if not keybutton.get_active():
+            return False
+        # wait for the key the modifiers are held for
+        if event.is_modifier:
+            return True
+
+        keys = [event.hardware_keycode - 8]
+        for mask, keycode in KeyNames.MODIFIERS:
+            if event.state & mask:
+                keys.append(keycode)
+        self._key = keys
+        keybutton.set_active(False)
+
+        radio = self._builder.get_object("piper-btnmap-keymap-radio")
+        if radio.get_active():
+            self._write_key(button)
+        else:
+            radio.set_active(True)
+        return True
 
     def on_actiontype_changed_macro(self, widget, button):
         if not widget.get_active():
             return
-        print("FIXME: change to macro")
+        self._write_macro(button)
+
+    def _write_macro(self, button):
+        # an empty macro is what a new recording starts with, there is
+        # nothing to upload yet
+        if len(self._macro) == 0:
+            return
+        # the buffer keeps changing while recording, write a snapshot
+        self._schedule_write(("mapping", id(button)),
+                             setattr, button, "macro", self._macro.copy())
+
+    def _update_macro_label(self):
+        self._macro_label_source = 0
+        label = self._builder.get_object("piper-btnmap-macro-label")
+        if len(self._macro) == 0:
+            label.set_text("No key sequence")
+        else:
+            label.set_text(self._key_names.macro_text(self._macro))
+        return False
+
+    def on_macro_record_toggled(self, widget, button):
+        if widget.get_active():
+            self._builder.get_object("piper-btnmap-keymap-button").set_active(False)
+            self._macro.clear()
+            self._update_macro_label()
+            radio = self._builder.get_object("piper-btnmap-keyseqmap-radio")
+            radio.set_active(True)
+        else:
+            self._macro.stop()
+            radio = self._builder.get_object("piper-btnmap-keyseqmap-radio")
+            if radio.get_active():
+                self._write_macro(button)
+
+    def on_macro_key_event(self, widget, event, pressed):
+        record = self._builder.get_object("piper-btnmap-macro-record-button")
+        if not record.get_active():
+            return False
+
+        # event.time is in ms, the delays are taken as typed
+        self._macro.record(event.hardware_keycode - 8, pressed, event.time)
+        # redraw the preview once per main loop iteration, not per event
+        if not self._macro_label_source:
+            self._macro_label_source = GLib.idle_add(self._update_macro_label)
+        # swallow the key, it is part of the macro
+        return True
+
+    def on_macro_edited(self, widget, button, edit):
+        edit(self._macro)
+        self._update_macro_label()
+        radio = self._builder.get_object("piper-btnmap-keyseqmap-radio")
+        if radio.get_active():
+            self._write_macro(button)
 
     def on_actiontype_changed_special(self, widget, button):
         val = self._custommap_combo_value()
         if val:
-            button.special = val
+            self._schedule_write(("mapping", id(button)),
+                                 setattr, button, "special", val)
 
     def _adjust_sensitivity_ranges(self):
         """
@@ -417,36 +1249,72 @@ class Piper(Gtk.Window):
             a1.set_lower(min)
             nres -= 1
 
-    def _update_from_device(self):
-        device = self._ratbag_device
-        profile = self._current_profile
+    def _update_capabilities(self, profile):
+        """
+        Shows the controls the resolutions of the profile support, from
+        their capabilities, so the widgets never write what ratbagd would
+        reject.
+        """
+        self._separate_xy = [False] * len(self._resolution_buttons)
+        for i, r in enumerate(profile.resolutions[:len(self._separate_xy)]):
+            self._separate_xy[i] = r.has_capability(RatbagdResolution.CAP_SEPARATE_XY_RESOLUTION)
+        separate = any(self._separate_xy)
+        self._yres_row.set_visible(separate)
+        self._xres_label.set_text("X resolutions" if separate else "Resolutions")
+        for sb, s in zip(self._yres_buttons, self._separate_xy):
+            sb.set_sensitive(s)
+
+        res = profile.active_resolution
+        if res is not None and res.has_capability(RatbagdResolution.CAP_INDIVIDUAL_REPORT_RATE):
+            self._rate_label.set_text("Report rate of resolution {}".format(res.index))
+        else:
+            self._rate_label.set_text("Report rate")
 
-        for i, b in enumerate(self._profile_buttons):
-            if device.profiles[i] == self._current_profile:
-                b.set_active(True)
-            else:
-                b.set_active(False)
+    def _update_report_rate(self, profile):
+        res = profile.active_resolution
+        if res is None:
+            # no resolution is active, there is no rate to show or set
+            for b in self._rate_buttons.values():
+                b.set_sensitive(False)
+            return
 
-        rate = profile.active_resolution.report_rate
+        rate = res.report_rate
         for r, b in self._rate_buttons.items():
             b.set_active(r == rate)
+            b.set_sensitive(True)
 
         if not rate in self._rate_buttons.keys():
             print("Ooops, rate is {} and I don't know how to deal with that.".format(rate))
             for b in self._rate_buttons.values():
                 b.set_sensitive(False)
 
+    def _update_from_device(self):
+        profile = self._current_profile
+
+        # compare indices, going through device.profiles would create
+        # every profile object just to compare it
+        for i, b in enumerate(self._profile_buttons):
+            b.set_active(i == profile.index)
+        if self._profile_enabled is not None:
+            self._profile_enabled.set_active(profile.enabled)
+
+        self._update_capabilities(profile)
+        self._update_report_rate(profile)
+
         res = profile.resolutions
         nres = len(res)
 
         for i, b in enumerate(self._resolution_buttons):
+            b.set_visible(i < nres)
+            self._yres_buttons[i].set_visible(i < nres)
             if i >= nres:
-                b.set_visible(False)
                 continue
 
-            xres = res[i].resolution[0]
+            xres, yres = res[i].resolution
             b.set_value(xres)
+            self._yres_buttons[i].set_value(yres)
 
+        self._nres_button.set_range(1, nres)
         self._nres_button.set_value(nres)
         self._adjust_sensitivity_ranges()
         self._set_button_row_function_labels(profile)
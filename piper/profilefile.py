@@ -0,0 +1,213 @@
+# vim: set expandtab shiftwidth=4 tabstop=4:
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next
+# paragraph) shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""
+Profile files hold the profiles, resolutions, report rates and button
+mappings of a device so they can be applied to other devices of the same
+model. They are JSON:
+
+    {
+      "format": "piper-profile",
+      "version": 1,
+      "device": {"description": "...", "svg": "..."},
+      "active_profile": 0,
+      "profiles": [ ... ]
+    }
+
+"device" identifies the model, the remaining members are a DeviceState
+as returned by DeviceState.to_dict(), without the id of the device.
+"""
+
+import collections
+import json
+import time
+
+from .devicestate import DeviceState, diff, apply_writes_async
+from .ratbagd import RatbagdDevice
+
+FORMAT = "piper-profile"
+VERSION = 1
+
+
+class ProfileFileError(ValueError):
+    """Signals a file that is not a profile file or one of a newer
+    version."""
+    pass
+
+
+class ProfileFile(object):
+    """The contents of a profile file.
+
+    @param description The description of the device model
+    @param svg The SVG file name of the device model
+    @param state The DeviceState to apply, without id
+    """
+
+    def __init__(self, description, svg, state):
+        self.description = description
+        self.svg = svg
+        self.state = state
+
+    @classmethod
+    def from_device(cls, device):
+        state = DeviceState.from_device(device).replace(id=None)
+        return cls(device.description, device.svg, state)
+
+    def matches(self, device):
+        """True if the given RatbagdDevice is of the model this file was
+        exported from."""
+        return device.description == self.description and device.svg == self.svg
+
+    def to_dict(self):
+        result = collections.OrderedDict()
+        result["format"] = FORMAT
+        result["version"] = VERSION
+        result["device"] = {"description": self.description, "svg": self.svg}
+        result.update(self.state.to_dict())
+        return result
+
+    @classmethod
+    def from_dict(cls, values):
+        if not isinstance(values, dict) or values.get("format") != FORMAT:
+            raise ProfileFileError("Not a profile file")
+        version = values.get("version")
+        if isinstance(version, bool) or not isinstance(version, int) \
+                or not 1 <= version <= VERSION:
+            raise ProfileFileError("Unsupported profile file version {}".format(version))
+
+        values = dict(values)
+        del values["format"]
+        del values["version"]
+        model = values.pop("device", {})
+        if not isinstance(model, dict):
+            raise ProfileFileError("Invalid profile file: device is not an object")
+        try:
+            state = DeviceState.from_dict(values)
+        except (TypeError, ValueError) as e:
+            raise ProfileFileError("Invalid profile file: {}".format(e))
+        return cls(model.get("description"), model.get("svg"), state)
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+            f.write("\n")
+
+    @classmethod
+    def load(cls, path):
+        """Reads a profile file. Raises OSError or ProfileFileError."""
+        with open(path) as f:
+            try:
+                values = json.load(f)
+            except ValueError as e:
+                raise ProfileFileError("Invalid profile file: {}".format(e))
+        return cls.from_dict(values)
+
+    def writes(self, device):
+        """Returns the list of devicestate.Write calls that apply this file
+        to the given RatbagdDevice. Raises ValueError if the file does not
+        fit the device."""
+        return diff(DeviceState.from_device(device), self.state)
+
+
+ProvisionResult = collections.namedtuple("ProvisionResult", [
+    "object_path", "seconds", "writes", "failed", "error"])
+ProvisionResult.__doc__ = """The outcome of applying a profile file to one
+device. writes is the number of calls sent, failed the list of (object,
+method, GLib.GError) of those that failed, error a message if the device
+could not be provisioned at all, otherwise None. seconds is the time from
+the start until the device replied."""
+
+
+def provision_async(ratbag, profile, callback, object_paths=None):
+    """Applies the profile file to all matching devices at once. The
+    descriptions of all devices are fetched in one round trip first, so
+    devices of another model are never loaded. Every matching device is
+    loaded and written in its own asynchronous pipeline on the main loop,
+    so the devices don't wait for each other; the total time is that of
+    the slowest device rather than the sum.
+
+    @param ratbag The Ratbagd manager
+    @param profile The ProfileFile to apply
+    @param callback Called as callback(results) with a list of
+                    ProvisionResult in the order of the devices, devices of
+                    another model are left out
+    @param object_paths The devices to consider, by default all
+    """
+    if object_paths is None:
+        object_paths = ratbag.devices.object_paths
+    results = [None] * len(object_paths)
+    pending = len(object_paths)
+    start = time.perf_counter()
+
+    def done(index, writes=0, failed=(), error=None, skipped=False):
+        nonlocal pending
+        if not skipped:
+            results[index] = ProvisionResult(object_paths[index],
+                                             time.perf_counter() - start,
+                                             writes, list(failed), error)
+        pending -= 1
+        if pending == 0:
+            callback([r for r in results if r is not None])
+
+    def on_device(device, error, index):
+        if error is not None:
+            done(index, error=error.message)
+            return
+        if not profile.matches(device):
+            done(index, skipped=True)
+            return
+
+        # anything raised here would escape into the main loop and leave
+        # the device pending forever
+        try:
+            writes = profile.writes(device)
+            if writes:
+                apply_writes_async(device, writes,
+                                   lambda failed: done(index, len(writes), failed))
+        except Exception as e:
+            done(index, error=str(e))
+            return
+        if not writes:
+            done(index)
+
+    def on_descriptions(descriptions):
+        for i, description in enumerate(descriptions):
+            # a device that could not be queried is loaded anyway so its
+            # error is reported
+            if description is None or description == profile.description:
+                RatbagdDevice.new_async(object_paths[i], on_device, i)
+            else:
+                done(i, skipped=True)
+
+    if not object_paths:
+        callback([])
+        return
+    ratbag.get_device_descriptions_async(object_paths, on_descriptions)
+
+
+def provision(ratbag, profile, object_paths=None):
+    """Blocking variant of provision_async(), returns the list of
+    ProvisionResult."""
+    def run(callback):
+        provision_async(ratbag, profile, callback, object_paths)
+    return ratbag._connection.run_sync(run)[0]
@@ -21,6 +21,17 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
+import array
+import atexit
+import bisect
+import collections
+import collections.abc
+import concurrent.futures
+import os
+import sys
+import time
+import weakref
+
 from gi.repository import Gio, GLib, GObject
 
 
@@ -29,42 +40,1041 @@ class RatbagdDBusUnavailable(BaseException):
     pass
 
 
-class _RatbagdDBus(GObject.GObject):
-    def __init__(self, interface, object_path):
-        GObject.GObject.__init__(self)
+# The largest value of the DBus "u" type, for keycodes and macro events
+_UINT32_MAX = 0xffffffff
+
+
+class _RatbagdStats(object):
+    """Counters and latency histograms of the DBus traffic, per interface
+    and method. See enable_stats()."""
+
+    # Upper bounds of the histogram buckets in ms, the last bucket is open
+    BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+    def __init__(self, slow_call_ms):
+        self.slow_call_ms = slow_call_ms
+        self.reset()
+
+    def reset(self):
+        self._entries = {}
+
+    def record(self, kind, interface, member, elapsed):
+        """Records one operation; kind is "call" for a round trip to the
+        bus, "proxy" for a proxy construction and "property" for a cached
+        property read."""
+        ms = elapsed * 1000
+        key = (kind, interface.split(".")[-1], member)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = [0, 0.0, 0.0, [0] * (len(self.BUCKETS) + 1)]
+            self._entries[key] = entry
+        entry[0] += 1
+        entry[1] += ms
+        entry[2] = max(entry[2], ms)
+        entry[3][bisect.bisect_left(self.BUCKETS, ms)] += 1
+
+        if self.slow_call_ms is not None and ms >= self.slow_call_ms:
+            print("ratbagd: slow {} {}.{} took {:.1f}ms".format(kind, key[1], member, ms),
+                  file=sys.stderr)
+
+    def dump(self, file):
+        interfaces = collections.Counter()
+        round_trips = 0
+        print("ratbagd DBus statistics:", file=file)
+        print("  {:<8} {:<36} {:>7} {:>10} {:>8} {:>8}".format(
+              "kind", "method", "count", "total ms", "avg ms", "max ms"), file=file)
+        for (kind, interface, member), (count, total, worst, hist) in sorted(self._entries.items()):
+            interfaces[(kind, interface)] += count
+            if kind == "call":
+                round_trips += count
+            print("  {:<8} {:<36} {:>7} {:>10.2f} {:>8.3f} {:>8.2f}".format(
+                  kind, "{}.{}".format(interface, member), count, total, total / count, worst),
+                  file=file)
+            buckets = ["<={}:{}".format(b, n) for b, n in zip(self.BUCKETS, hist) if n]
+            if hist[-1]:
+                buckets.append(">{}:{}".format(self.BUCKETS[-1], hist[-1]))
+            print("           latency ms {}".format(" ".join(buckets)), file=file)
+
+        print("  per interface:", file=file)
+        for (kind, interface), count in sorted(interfaces.items()):
+            print("    {:<8} {:<27} {:>7}".format(kind, interface, count), file=file)
+        print("  round trips: {}".format(round_trips), file=file)
+
+
+# None unless enabled, checked before any instrumentation so that disabled
+# statistics cost a single comparison
+_stats = None
+_dump_registered = False
+
+
+def enable_stats(slow_call_ms=None, dump_at_exit=False):
+    """Starts collecting per-interface and per-method counters and latency
+    histograms of all DBus calls, proxy constructions and property reads.
+    Statistics are also enabled by setting RATBAGD_STATS=1 in the
+    environment, with RATBAGD_SLOW_CALL_MS as slow_call_ms.
+
+    @param slow_call_ms Log operations taking at least this many ms to
+                        stderr, or None
+    @param dump_at_exit Print the statistics to stderr when Python exits
+    """
+    global _stats, _dump_registered
+    if _stats is None:
+        _stats = _RatbagdStats(slow_call_ms)
+    else:
+        _stats.slow_call_ms = slow_call_ms
+    if dump_at_exit and not _dump_registered:
+        atexit.register(dump_stats)
+        _dump_registered = True
+
+
+def disable_stats():
+    """Stops collecting statistics and discards them."""
+    global _stats
+    _stats = None
+
+
+def reset_stats():
+    """Discards the statistics collected so far, e.g. before measuring a
+    single operation."""
+    if _stats is not None:
+        _stats.reset()
+
+
+def dump_stats(file=None):
+    """Prints a summary of the statistics collected so far."""
+    if _stats is not None:
+        _stats.dump(file if file is not None else sys.stderr)
+
 
-        self._dbus = Gio.bus_get_sync(Gio.BusType.SYSTEM, None)
-        if self._dbus is None:
+if os.environ.get("RATBAGD_STATS"):
+    try:
+        _slow = float(os.environ.get("RATBAGD_SLOW_CALL_MS", ""))
+    except ValueError:
+        # unset or not a number, don't log slow calls
+        _slow = None
+    enable_stats(_slow, dump_at_exit=True)
+
+
+def _unpack_properties(variant):
+    """Splits an a{sv} GLib.Variant into a dict of property names to
+    GLib.Variant values, suitable for Gio.DBusProxy.set_cached_property()."""
+    props = {}
+    for i in range(variant.n_children()):
+        entry = variant.get_child_value(i)
+        name = entry.get_child_value(0).get_string()
+        props[name] = entry.get_child_value(1).get_variant()
+    return props
+
+
+class _RatbagdConnection(object):
+    """The system bus connection shared by all ratbagd objects.
+
+    Proxies prepared in advance from a snapshot (see load_snapshot()) are
+    kept in a pool until the object for their path is constructed, so that
+    constructing the object does not need another round trip.
+
+    The signals of all objects arrive through a single subscription and
+    are dispatched by object path to the object's _on_signal(), see
+    register().
+    """
+
+    _instance = None
+
+    @classmethod
+    def get(cls):
+        """Returns the shared connection, connecting to the bus if needed."""
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        try:
+            self.bus = Gio.bus_get_sync(Gio.BusType.SYSTEM, None)
+        except GLib.GError:
+            raise RatbagdDBusUnavailable()
+        if self.bus is None:
             raise RatbagdDBusUnavailable()
 
+        self._owner = None
+        self._proxies = {}
+        # The paths in the pool by the path of their device
+        self._pooled = {}
+        self._objects = weakref.WeakValueDictionary()
+
+        # One subscription for all signals of all objects, routed to the
+        # object by its path. The proxies don't subscribe themselves, so
+        # there is one match rule instead of one or two per object.
+        self._subscription = self.bus.signal_subscribe("org.freedesktop.ratbag1",
+                                                       None, None, None, None,
+                                                       Gio.DBusSignalFlags.NONE,
+                                                       self._on_signal)
+        # The pooled proxies talk to the unique name ratbagd had when they
+        # were prepared, they are useless once it restarted
+        self._owner_subscription = self.bus.signal_subscribe("org.freedesktop.DBus",
+                                                             "org.freedesktop.DBus",
+                                                             "NameOwnerChanged",
+                                                             "/org/freedesktop/DBus",
+                                                             "org.freedesktop.ratbag1",
+                                                             Gio.DBusSignalFlags.NONE,
+                                                             self._on_name_owner_changed)
+
+    def close(self):
+        """Unsubscribes from the signals and drops the proxy pool and the
+        registry, so the next get() starts from a cold connection, e.g. for
+        each run of tools/benchmark.py. Objects created before no longer
+        receive signals."""
+        if self._subscription:
+            self.bus.signal_unsubscribe(self._subscription)
+            self.bus.signal_unsubscribe(self._owner_subscription)
+            self._subscription = 0
+        self._proxies.clear()
+        self._pooled.clear()
+        self._objects.clear()
+        if _RatbagdConnection._instance is self:
+            _RatbagdConnection._instance = None
+
+    def get_object(self, cls, object_path, *args):
+        """Returns the live object for the given path or, if there is none,
+        creates it as cls(object_path, *args). As long as all objects are
+        obtained through here, there is exactly one Python object per
+        ratbagd object, so objects can be compared by identity.
+
+        The objects are only referenced weakly, an object is freed as soon
+        as the caller drops it, e.g. once its device was removed.
+        """
+        obj = self._objects.get(object_path)
+        if obj is None or not isinstance(obj, cls):
+            obj = cls(object_path, *args)
+        return obj
+
+    def register(self, obj, object_path):
+        """Registers a constructed ratbagd object so that later snapshots
+        update it in place."""
+        self._objects[object_path] = obj
+
+    def _on_signal(self, bus, sender, object_path, interface, signal, params):
+        obj = self._objects.get(object_path)
+        if obj is None:
+            return
+        if interface == "org.freedesktop.DBus.Properties":
+            if signal == "PropertiesChanged":
+                self._on_properties_changed(obj, object_path, params)
+        elif interface == obj._proxy.get_interface_name():
+            obj._on_signal(signal, params)
+
+    def _on_properties_changed(self, obj, object_path, params):
+        if params.get_child_value(0).get_string() != obj._proxy.get_interface_name():
+            return
+
+        changed = _unpack_properties(params.get_child_value(1))
+        for name, value in changed.items():
+            obj._proxy.set_cached_property(name, value)
+        if changed:
+            obj._properties_changed(changed.keys())
+
+        # Invalidated properties come without their value, fetch them
+        invalidated = params.get_child_value(2).unpack()
+        if not invalidated:
+            return
+
+        def on_get(results):
+            changed = []
+            for name, result in zip(invalidated, results):
+                if not isinstance(result, GLib.GError):
+                    obj._proxy.set_cached_property(name, result.get_child_value(0).get_variant())
+                    changed.append(name)
+            obj._properties_changed(changed)
+
+        iface = obj._proxy.get_interface_name()
+        calls = [(object_path, "org.freedesktop.DBus.Properties", "Get",
+                  GLib.Variant("(ss)", (iface, name))) for name in invalidated]
+        self.call_many_async(calls, on_get)
+
+    def _on_name_owner_changed(self, bus, sender, path, interface, signal, params):
+        owner = params.unpack()[2]
+        self._owner = owner or None
+        self._proxies.clear()
+        self._pooled.clear()
+
+    def drop_proxies(self, device_path):
+        """Drops the pooled proxies of the given device, e.g. once it was
+        removed."""
+        for path in self._pooled.pop(device_path, ()):
+            self._proxies.pop(path, None)
+
+    def has_proxy(self, object_path):
+        """Returns True if a proxy for the given path is waiting in the
+        pool."""
+        return object_path in self._proxies
+
+    def new_proxy(self, interface, object_path):
+        """Returns a proxy for the given object, either from the pool of
+        proxies prepared in advance or by creating one synchronously."""
+        proxy = self._proxies.pop(object_path, None)
+        if proxy is not None:
+            if _stats is not None:
+                _stats.record("proxy", interface, "pooled", 0)
+            return proxy
+
+        stats = _stats
+        if stats is not None:
+            start = time.perf_counter()
+        # Like the pooled proxies, the proxy talks to ratbagd's unique name
+        # and its properties are fetched here rather than by the proxy, so
+        # it adds no match rules of its own to the bus daemon
+        flags = Gio.DBusProxyFlags.DO_NOT_LOAD_PROPERTIES
+        flags |= Gio.DBusProxyFlags.DO_NOT_CONNECT_SIGNALS
+        interface = "org.freedesktop.ratbag1.{}".format(interface)
         try:
-            self._proxy = Gio.DBusProxy.new_sync(self._dbus,
-                                                 Gio.DBusProxyFlags.NONE,
-                                                 None,
-                                                 "org.freedesktop.ratbag1",
-                                                 object_path,
-                                                 "org.freedesktop.ratbag1.{}".format(interface),
-                                                 None)
+            if self._owner is None:
+                reply = self.bus.call_sync("org.freedesktop.DBus", "/org/freedesktop/DBus",
+                                           "org.freedesktop.DBus", "GetNameOwner",
+                                           GLib.Variant("(s)", ("org.freedesktop.ratbag1",)),
+                                           None, Gio.DBusCallFlags.NONE, 500, None)
+                self._owner = reply.unpack()[0]
+            proxy = Gio.DBusProxy.new_sync(self.bus, flags, None, self._owner,
+                                           object_path, interface, None)
         except GLib.GError:
             raise RatbagdDBusUnavailable()
+        # as with a proxy that loads its properties, an object without them
+        # is left empty
+        try:
+            reply = self.bus.call_sync(self._owner, object_path,
+                                       "org.freedesktop.DBus.Properties", "GetAll",
+                                       GLib.Variant("(s)", (interface,)),
+                                       None, Gio.DBusCallFlags.NONE, -1, None)
+        except GLib.GError:
+            reply = None
+        if reply is not None:
+            for name, value in _unpack_properties(reply.get_child_value(0)).items():
+                proxy.set_cached_property(name, value)
+        if stats is not None:
+            stats.record("proxy", interface.split(".")[-1], "new_sync",
+                         time.perf_counter() - start)
+        return proxy
+
+    def call_many_async(self, calls, callback, *args, timeout=500,
+                        cancellable=None):
+        """Sends all the given method calls to ratbagd at once and collects
+        the replies, so the calls cost one round trip of latency in total.
+
+        @param calls A list of (object path, interface, method, parameters)
+                     tuples, parameters being a GLib.Variant tuple or None
+        @param callback Called as callback(results, *args) once all replies
+                        arrived, results being a list in the order of calls
+                        with either the reply GLib.Variant or a GLib.GError
+        @param timeout The deadline for the whole batch in ms. All calls are
+                       sent at once, so calls still unanswered after this
+                       time fail with G_IO_ERROR_TIMED_OUT
+        @param cancellable A Gio.Cancellable that makes all unanswered
+                           calls fail with G_IO_ERROR_CANCELLED
+        """
+        results = [None] * len(calls)
+        pending = len(calls)
+        stats = _stats
+        start = time.perf_counter() if stats is not None else 0
+
+        def on_reply(source, result, index):
+            nonlocal pending
+            try:
+                results[index] = source.call_finish(result)
+            except GLib.GError as e:
+                results[index] = e
+            if stats is not None:
+                _, interface, method, _ = calls[index]
+                stats.record("call", interface, method, time.perf_counter() - start)
+            pending -= 1
+            if pending == 0:
+                callback(results, *args)
+
+        if not calls:
+            callback(results, *args)
+            return
+
+        for i, (object_path, interface, method, params) in enumerate(calls):
+            self.bus.call("org.freedesktop.ratbag1", object_path, interface,
+                          method, params, None,
+                          Gio.DBusCallFlags.NO_AUTO_START, timeout, cancellable,
+                          on_reply, i)
+
+    def run_sync(self, func, *args):
+        """Runs the asynchronous func(*args, callback) to completion on a
+        private main context and returns the arguments the callback was
+        called with. Used to provide blocking variants of the asynchronous
+        methods without dispatching unrelated events."""
+        context = GLib.MainContext()
+        context.push_thread_default()
+        result = None
+
+        def on_done(*res):
+            nonlocal result
+            result = res
+
+        try:
+            func(*args, on_done)
+            while result is None:
+                context.iteration(True)
+        finally:
+            context.pop_thread_default()
+        return result
+
+    def lookup_owner_async(self, callback, *args):
+        """Looks up the unique bus name of ratbagd, which the proxies
+        prepared by _apply_snapshot() talk to. It changes whenever ratbagd
+        is restarted.
+
+        @param callback Called as callback(error, *args) when done, error
+                        is None or a GLib.GError
+        """
+        stats = _stats
+        start = time.perf_counter() if stats is not None else 0
+
+        def on_name_owner(source, result):
+            if stats is not None:
+                stats.record("call", "DBus", "GetNameOwner", time.perf_counter() - start)
+            try:
+                owner = source.call_finish(result).unpack()[0]
+            except GLib.GError as e:
+                callback(e, *args)
+                return
+            if self._owner is not None and owner != self._owner:
+                self._proxies.clear()
+                self._pooled.clear()
+            self._owner = owner
+            callback(None, *args)
+
+        self.bus.call("org.freedesktop.DBus", "/org/freedesktop/DBus",
+                      "org.freedesktop.DBus", "GetNameOwner",
+                      GLib.Variant("(s)", ("org.freedesktop.ratbag1",)),
+                      None, Gio.DBusCallFlags.NONE, 500, None,
+                      on_name_owner)
+
+    def load_snapshot_async(self, object_path, callback, *args):
+        """Fetches the properties of a device and all of its profiles,
+        resolutions and buttons in a small, fixed number of bus messages.
+
+        ratbagd's ObjectManager is tried first which returns everything in
+        one message. If that is not available, the properties are fetched
+        with pipelined GetAll calls, one round trip for each level of the
+        object tree.
+
+        Objects that already exist are updated in place, proxies for all
+        other objects are prepared in the pool so they can be constructed
+        without further bus traffic.
+
+        @param object_path The DBus object path of the device
+        @param callback Called as callback(error, *args) when done, error
+                        is None or a GLib.GError
+        """
+        snapshot = {}
+
+        def get_all_calls(interface, paths):
+            iface = "org.freedesktop.ratbag1.{}".format(interface)
+            return [(p, "org.freedesktop.DBus.Properties", "GetAll",
+                     GLib.Variant("(s)", (iface,))) for p in paths]
+
+        def on_get_all(results, calls, interfaces):
+            for (path, _, _, _), interface, result in zip(calls, interfaces, results):
+                if isinstance(result, GLib.GError):
+                    finish(result)
+                    return
+                snapshot[path] = (interface,
+                                  _unpack_properties(result.get_child_value(0)))
+
+            calls, interfaces = [], []
+            for path, interface in list(walk()):
+                if path not in snapshot:
+                    calls += get_all_calls(interface, [path])
+                    interfaces.append(interface)
+            if calls:
+                self.call_many_async(calls, on_get_all, calls, interfaces)
+            else:
+                finish(None)
+
+        def walk():
+            # Yields the (path, interface) of all objects of the device
+            # reachable with the properties fetched so far
+            yield object_path, "Device"
+            if object_path not in snapshot:
+                return
+            profiles = snapshot[object_path][1].get("Profiles")
+            for p in profiles.unpack() if profiles is not None else []:
+                yield p, "Profile"
+                if p not in snapshot:
+                    continue
+                props = snapshot[p][1]
+                for name, interface in (("Resolutions", "Resolution"),
+                                        ("Buttons", "Button")):
+                    if name in props:
+                        for path in props[name].unpack():
+                            yield path, interface
+
+        def on_managed_objects(results):
+            result = results[0]
+            if isinstance(result, GLib.GError):
+                # No ObjectManager, fall back to GetAll
+                calls = get_all_calls("Device", [object_path])
+                self.call_many_async(calls, on_get_all, calls, ["Device"])
+                return
+
+            managed = {}
+            objects = result.get_child_value(0)
+            for i in range(objects.n_children()):
+                entry = objects.get_child_value(i)
+                path = entry.get_child_value(0).get_string()
+                interfaces = entry.get_child_value(1)
+                for j in range(interfaces.n_children()):
+                    iface = interfaces.get_child_value(j)
+                    name = iface.get_child_value(0).get_string()
+                    if name.startswith("org.freedesktop.ratbag1."):
+                        props = _unpack_properties(iface.get_child_value(1))
+                        managed[path] = (name.split(".")[-1], props)
+
+            # walk() only descends into objects already in the snapshot,
+            # so fill it until no new objects are reachable
+            added = True
+            while added:
+                added = False
+                for path, interface in list(walk()):
+                    if path not in snapshot and path in managed:
+                        snapshot[path] = managed[path]
+                        added = True
+            finish(None)
+
+        def on_name_owner(error):
+            if error is not None:
+                callback(error, *args)
+                return
+            calls = [("/org/freedesktop/ratbag1",
+                      "org.freedesktop.DBus.ObjectManager",
+                      "GetManagedObjects", None)]
+            self.call_many_async(calls, on_managed_objects)
+
+        def finish(error):
+            if error is None:
+                self._apply_snapshot(snapshot)
+            callback(error, *args)
+
+        self.lookup_owner_async(on_name_owner)
+
+    def load_snapshot(self, object_path):
+        """Blocking variant of load_snapshot_async(). Returns None or the
+        GLib.GError."""
+        return self.run_sync(self.load_snapshot_async, object_path)[0]
+
+    def export_snapshot(self, objects):
+        """Returns the cached properties of the given ratbagd objects as a
+        GLib.Variant of type a{s(sa{sv})}, mapping each object path to its
+        interface name and properties. See import_snapshot()."""
+        snapshot = {}
+        for obj in objects:
+            proxy = obj._proxy
+            props = {name: proxy.get_cached_property(name)
+                     for name in proxy.get_cached_property_names()}
+            interface = proxy.get_interface_name().split(".")[-1]
+            snapshot[proxy.get_object_path()] = (interface, props)
+        return GLib.Variant("a{s(sa{sv})}", snapshot)
+
+    def import_snapshot(self, variant):
+        """Applies a snapshot returned by export_snapshot(), as if it had
+        been loaded from ratbagd. Costs one round trip to look up the bus
+        name of ratbagd if it is not known yet. Objects that already exist
+        are left alone, their state is newer. Returns None or the
+        GLib.GError."""
+        if self._owner is None:
+            error = self.run_sync(self.lookup_owner_async)[0]
+            if error is not None:
+                return error
+
+        snapshot = {}
+        for i in range(variant.n_children()):
+            entry = variant.get_child_value(i)
+            path = entry.get_child_value(0).get_string()
+            value = entry.get_child_value(1)
+            snapshot[path] = (value.get_child_value(0).get_string(),
+                              _unpack_properties(value.get_child_value(1)))
+        self._apply_snapshot(snapshot, preload=True)
+        return None
+
+    def _apply_snapshot(self, snapshot, preload=False):
+        flags = Gio.DBusProxyFlags.DO_NOT_LOAD_PROPERTIES
+        flags |= Gio.DBusProxyFlags.DO_NOT_CONNECT_SIGNALS
+        device_path = next((path for path, (interface, _) in snapshot.items()
+                            if interface == "Device"), None)
+        pooled = self._pooled.setdefault(device_path, set())
+        if not preload:
+            # A fresh snapshot validates the device, pooled proxies of
+            # objects it no longer has, e.g. from an outdated cache, go
+            for path in pooled - set(snapshot):
+                self._proxies.pop(path, None)
+            pooled.intersection_update(snapshot)
+
+        for path, (interface, props) in snapshot.items():
+            obj = self._objects.get(path)
+            if obj is not None:
+                if preload:
+                    continue
+                for name, value in props.items():
+                    obj._proxy.set_cached_property(name, value)
+                obj._properties_changed(props.keys())
+                continue
+
+            # The proxy talks to ratbagd's unique name and does not load
+            # properties, so creating it does not cost a round trip
+            try:
+                proxy = Gio.DBusProxy.new_sync(self.bus,
+                                               flags,
+                                               None,
+                                               self._owner,
+                                               path,
+                                               "org.freedesktop.ratbag1.{}".format(interface),
+                                               None)
+            except GLib.GError:
+                continue
+            for name, value in props.items():
+                proxy.set_cached_property(name, value)
+            self._proxies[path] = proxy
+            pooled.add(path)
 
+
+class _RatbagdDBus(GObject.GObject):
+    # Maps DBus property names to the GObject property that changes with
+    # them, see _properties_changed()
+    _PROPERTIES = {}
+
+    # Maps the methods that change this object to the DBus properties they
+    # set, as (name, signature, value) tuples where value is the index of
+    # the method argument or a constant string, see _cache_write()
+    _WRITES = {}
+
+    def __init__(self, interface, object_path, device=None):
+        GObject.GObject.__init__(self)
+
+        # Only the path of the device is kept, a reference would make each
+        # device a reference cycle that outlives its removal
+        if isinstance(device, _RatbagdDBus):
+            device = device._objpath
+        self._device_path = device
+        self._connection = _RatbagdConnection.get()
+        self._proxy = self._connection.new_proxy(interface, object_path)
         if self._proxy.get_name_owner() is None:
             raise RatbagdDBusUnavailable()
+        self._connection.register(self, object_path)
+
+    @property
+    def _device(self):
+        """The RatbagdDevice this object belongs to, or None."""
+        if self._device_path is None:
+            return None
+        return self._connection._objects.get(self._device_path)
+
+    def _load_properties(self):
+        """Reads the cached values of this object from its proxy. Called
+        again whenever the proxy's properties were updated."""
+        pass
+
+    def _on_signal(self, signal, params):
+        """Called with the name and the GLib.Variant parameters of each
+        signal ratbagd emits on this object."""
+        pass
+
+    def _written_properties(self, method, value):
+        """Returns a dict of the DBus property names the given call sets to
+        their new GLib.Variant value."""
+        props = {}
+        for name, signature, v in self._WRITES.get(method, ()):
+            props[name] = GLib.Variant(signature, value[v] if isinstance(v, int) else v)
+        return props
+
+    def _cache_write(self, method, value):
+        """Stores the values a successful call set in the proxy, so they
+        survive the next reload of the properties without waiting for
+        ratbagd's PropertiesChanged."""
+        props = self._written_properties(method, value)
+        for name, v in props.items():
+            self._proxy.set_cached_property(name, v)
+        self._properties_changed(props.keys())
+
+    def _reset_write(self, method):
+        """Resets the properties a failed call would have set to their
+        last known device state."""
+        self._properties_changed([name for name, _, _ in self._WRITES.get(method, ())])
+
+    def _properties_changed(self, names):
+        """Reloads the cached values after the given DBus properties were
+        updated in the proxy and emits notify for each GObject property
+        whose value actually changed."""
+        props = {self._PROPERTIES[n] for n in names if n in self._PROPERTIES}
+        old = {p: self.get_property(p) for p in props}
+        self._load_properties()
+        for p in props:
+            if self.get_property(p) != old[p]:
+                self.notify(p)
 
     def dbus_property(self, property):
+        # A change staged in the open transaction wins over the device
+        # state, so reloading the properties keeps the staged values
+        transaction = self._open_transaction()
+        if transaction is not None:
+            p = transaction._staged_property(self._objpath, property)
+            if p is not None:
+                return p.unpack()
+
+        stats = _stats
+        if stats is not None:
+            start = time.perf_counter()
         p = self._proxy.get_cached_property(property)
+        if stats is not None:
+            stats.record("property", self._proxy.get_interface_name(), property,
+                         time.perf_counter() - start)
         if p is not None:
             return p.unpack()
         return p
 
-    def dbus_call(self, method, type, *value):
+    def dbus_call(self, method, type, *value, timeout=500, cancellable=None):
         val = GLib.Variant("({})".format(type), value)
-        res = self._proxy.call_sync(method, val,
-                                    Gio.DBusCallFlags.NO_AUTO_START, 500, None)
+        stats = _stats
+        if stats is not None:
+            start = time.perf_counter()
+        try:
+            res = self._proxy.call_sync(method, val,
+                                        Gio.DBusCallFlags.NO_AUTO_START,
+                                        timeout, cancellable)
+        finally:
+            if stats is not None:
+                stats.record("call", self._proxy.get_interface_name(), method,
+                             time.perf_counter() - start)
         if res is not None:
             return res.unpack()
         return res
 
+    def dbus_call_async(self, method, type, *value, callback=None,
+                        timeout=500, cancellable=None):
+        """Non-blocking variant of dbus_call(). Returns a
+        concurrent.futures.Future with the unpacked result or the
+        GLib.GError; it is resolved from the GLib main loop, so use
+        asyncio.wrap_future() to await it from an asyncio event loop that
+        runs on top of GLib.
+
+        @param callback Called as callback(result, error) when done, error
+                        is None or the GLib.GError
+        @param timeout The timeout in ms
+        @param cancellable A Gio.Cancellable to cancel the call with
+        """
+        future = concurrent.futures.Future()
+        future.set_running_or_notify_cancel()
+        stats = _stats
+        start = time.perf_counter() if stats is not None else 0
+
+        def on_reply(proxy, result):
+            if stats is not None:
+                stats.record("call", proxy.get_interface_name(), method,
+                             time.perf_counter() - start)
+            try:
+                res = proxy.call_finish(result)
+                if res is not None:
+                    res = res.unpack()
+            except GLib.GError as e:
+                future.set_exception(e)
+                if callback is not None:
+                    callback(None, e)
+                return
+            future.set_result(res)
+            if callback is not None:
+                callback(res, None)
+
+        val = GLib.Variant("({})".format(type), value)
+        self._proxy.call(method, val, Gio.DBusCallFlags.NO_AUTO_START,
+                         timeout, cancellable, on_reply)
+        return future
+
+    @staticmethod
+    def dbus_call_many_async(calls, callback=None, timeout=500, cancellable=None):
+        """Sends a batch of method calls, possibly on several objects, at
+        once over the shared connection, e.g. to set all resolutions of a
+        profile. The batch costs one round trip of latency instead of one
+        per call. Unlike dbus_write(), the calls are never staged in a
+        transaction and don't update the objects' cached values; ratbagd's
+        PropertiesChanged signals do that once the device changed.
+
+        Returns a concurrent.futures.Future with the list of results, see
+        dbus_call_async().
+
+        @param calls A list of (object, method, type, value) tuples with
+                     the arguments of dbus_call(), value being a tuple
+        @param callback Called as callback(results) once all replies
+                        arrived, results being a list in the order of calls
+                        with either the unpacked result or a GLib.GError
+        @param timeout The deadline for the whole batch in ms
+        @param cancellable A Gio.Cancellable to cancel all unanswered calls
+                           with
+        """
+        future = concurrent.futures.Future()
+        future.set_running_or_notify_cancel()
+
+        def on_replies(results):
+            results = [r if isinstance(r, GLib.GError) or r is None else r.unpack()
+                       for r in results]
+            future.set_result(results)
+            if callback is not None:
+                callback(results)
+
+        dbus_calls = [(obj._proxy.get_object_path(), obj._proxy.get_interface_name(),
+                       method, GLib.Variant("({})".format(type), tuple(value)))
+                      for obj, method, type, value in calls]
+        _RatbagdConnection.get().call_many_async(dbus_calls, on_replies,
+                                                 timeout=timeout,
+                                                 cancellable=cancellable)
+        return future
+
+    @staticmethod
+    def dbus_call_many(calls, timeout=500, cancellable=None):
+        """Blocking variant of dbus_call_many_async(), returns the list of
+        results."""
+        connection = _RatbagdConnection.get()
+
+        def run(callback):
+            _RatbagdDBus.dbus_call_many_async(calls, callback, timeout, cancellable)
+        return connection.run_sync(run)[0]
+
+    def _open_transaction(self):
+        device = self._device if self._device is not None else self
+        return getattr(device, "_transaction", None)
+
+    def dbus_write(self, key, method, type, *value, **kwargs):
+        """Like dbus_call() but for calls that change the device. If the
+        device has an open RatbagdTransaction, the call is staged there and
+        None is returned.
+
+        @param key Identifies what the call changes, a later call with the
+                   same key on this object replaces a staged one
+        """
+        transaction = self._open_transaction()
+        if transaction is not None:
+            transaction.stage(self, key, method, type, *value)
+            return None
+        result = self.dbus_call(method, type, *value, **kwargs)
+        self._cache_write(method, value)
+        return result
+
+    def dbus_write_async(self, key, method, type, *value, callback=None,
+                         **kwargs):
+        """Non-blocking variant of dbus_write(), see dbus_call_async(). If
+        the call fails, the properties it changes are reset to their last
+        known device state."""
+        transaction = self._open_transaction()
+        if transaction is not None:
+            transaction.stage(self, key, method, type, *value)
+            future = concurrent.futures.Future()
+            future.set_running_or_notify_cancel()
+            future.set_result(None)
+            if callback is not None:
+                callback(None, None)
+            return future
+
+        def on_done(result, error):
+            if error is not None:
+                self._reset_write(method)
+            else:
+                self._cache_write(method, value)
+            if callback is not None:
+                callback(result, error)
+
+        return self.dbus_call_async(method, type, *value, callback=on_done,
+                                    **kwargs)
+
+
+def _apply_results(calls, results):
+    # Caches the values of the calls from a dbus_call_many_async() batch
+    # that succeeded and resets those that failed, returns the list of
+    # (object, method, GLib.GError) of the failed calls
+    failed = []
+    for (obj, method, _, value), result in zip(calls, results):
+        if isinstance(result, GLib.GError):
+            failed.append((obj, method, result))
+            obj._reset_write(method)
+        else:
+            obj._cache_write(method, value)
+    return failed
+
+
+class RatbagdTransaction(object):
+    """A set of changes to a RatbagdDevice that are staged locally and only
+    written to the device by commit(), see RatbagdDevice.transaction().
+
+    Repeated changes to the same property only keep the last value, and
+    commit() sends all remaining calls at once, so applying any number of
+    edits costs one round trip. When used as context manager, the
+    transaction is committed on exit or rolled back if an exception was
+    raised.
+    """
+
+    def __init__(self, device):
+        # the open transaction is referenced by the device
+        self._device_ref = weakref.ref(device)
+        self._changes = collections.OrderedDict()
+        # The DBus property values of the staged changes by object path,
+        # see _RatbagdDBus.dbus_property()
+        self._staged = {}
+
+    @property
+    def _device(self):
+        return self._device_ref()
+
+    def __len__(self):
+        return len(self._changes)
+
+    def stage(self, obj, key, method, type, *value):
+        """Stages the method call on the given object, replacing any staged
+        call with the same key on that object."""
+        k = (obj._objpath, key)
+        # Re-insert so the calls are sent in the order of the last change
+        self._changes.pop(k, None)
+        self._changes[k] = (obj, method, type, value)
+        self._update_staged(obj._objpath)
+
+    def _update_staged(self, object_path):
+        # Later changes replace earlier ones, e.g. ActionType
+        props = {}
+        for (path, _), (obj, method, _, value) in self._changes.items():
+            if path == object_path:
+                props.update(obj._written_properties(method, value))
+        self._staged[object_path] = props
+
+    def _staged_property(self, object_path, name):
+        """Returns the GLib.Variant a staged change sets the property to, or
+        None."""
+        props = self._staged.get(object_path)
+        return props.get(name) if props else None
+
+    def prune(self, object_paths):
+        """Drops the staged changes of all objects that are not in
+        object_paths, e.g. after a refresh showed that profiles,
+        resolutions or buttons of the device are gone."""
+        object_paths = set(object_paths)
+        objects = set()
+        for k in [k for k in self._changes if k[0] not in object_paths]:
+            objects.add(self._changes.pop(k)[0])
+        for path in [p for p in self._staged if p not in object_paths]:
+            del self._staged[path]
+        for obj in objects:
+            obj._properties_changed(obj._PROPERTIES.keys())
+
+    def _close(self):
+        if self._device._transaction is not self:
+            raise ValueError("Transaction is not open")
+        self._device._transaction = None
+        self._staged.clear()
+
+    def commit(self, timeout=500, cancellable=None):
+        """Writes all staged changes to the device and closes the
+        transaction. Returns a list of (object, method, GLib.GError) tuples
+        for the calls that failed; the properties they change are reset to
+        their last known device state.
+
+        @param timeout The deadline for all calls together in ms
+        @param cancellable A Gio.Cancellable to cancel the unanswered calls
+                           with, they are then reported as failed
+        """
+        connection = self._device._connection
+
+        def run(callback):
+            self.commit_async(callback, timeout, cancellable)
+        return connection.run_sync(run)[0]
+
+    def commit_async(self, callback, timeout=500, cancellable=None):
+        """Non-blocking variant of commit(). The transaction is closed
+        immediately, callback(failed) is called with the list of failed
+        calls once the device replied."""
+        self._close()
+
+        changes = list(self._changes.values())
+        self._changes.clear()
+
+        def on_replies(results):
+            callback(_apply_results(changes, results))
+
+        _RatbagdDBus.dbus_call_many_async(changes, on_replies, timeout, cancellable)
+
+    def rollback(self):
+        """Discards all staged changes and closes the transaction. The
+        affected objects are reset to their last known device state."""
+        self._close()
+
+        objects = {obj for obj, _, _, _ in self._changes.values()}
+        self._changes.clear()
+        for obj in objects:
+            obj._properties_changed(obj._PROPERTIES.keys())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+
+class _RatbagdLazyList(collections.abc.Sequence):
+    """A read-only list of ratbagd objects. The objects are only created
+    (and thus their DBus proxies only set up) when an entry is first
+    accessed, after which they are cached.
+
+    @param cls The class to create the objects with, called with the
+               object path and args
+    @param object_paths The DBus object paths of the list entries
+    """
+
+    def __init__(self, cls, object_paths, *args):
+        self._cls = cls
+        self._args = args
+        self._paths = list(object_paths)
+        self._objects = [None] * len(self._paths)
+
+    def __len__(self):
+        return len(self._paths)
+
+    @property
+    def object_paths(self):
+        """The DBus object paths of the entries, without creating them."""
+        return list(self._paths)
+
+    def _add(self, object_path):
+        if object_path not in self._paths:
+            self._paths.append(object_path)
+            self._objects.append(None)
+
+    def _remove(self, object_path):
+        try:
+            i = self._paths.index(object_path)
+        except ValueError:
+            return
+        del self._paths[i]
+        del self._objects[i]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        obj = self._objects[index]
+        if obj is None:
+            obj = _RatbagdConnection.get().get_object(self._cls, self._paths[index],
+                                                      *self._args)
+            self._objects[index] = obj
+        return obj
+
+
+def _find_by_index(objects, index):
+    # The lists are in index order, only look further if they are not
+    if 0 <= index < len(objects) and objects[index].index == index:
+        return objects[index]
+    for obj in objects:
+        if obj.index == index:
+            return obj
+    return None
+
 
 class Ratbagd(_RatbagdDBus):
     """The ratbagd top-level object. Provides a list of devices available
@@ -83,24 +1093,72 @@ class Ratbagd(_RatbagdDBus):
 
     def __init__(self):
         _RatbagdDBus.__init__(self, "Manager", "/org/freedesktop/ratbag1")
-        self._proxy.connect("g-signal", self._on_g_signal)
-        self._devices = []
         result = self.dbus_property("Devices")
-        if result is not None:
-            self._devices = [RatbagdDevice(objpath) for objpath in result]
+        self._devices = _RatbagdLazyList(RatbagdDevice, result or [])
 
-    def _on_g_signal(self, proxy, sender, signal, params):
+    def _on_signal(self, signal, params):
         params = params.unpack()
+        # Update the list in place, only the new device is created and
+        # only once it is accessed
         if signal == "DeviceNew":
+            self._devices._add(params[0])
             self.emit("device-added", params[0])
         elif signal == "DeviceRemoved":
+            self._devices._remove(params[0])
+            self._connection.drop_proxies(params[0])
             self.emit("device-removed", params[0])
 
     @GObject.Property
     def devices(self):
-        """A list of RatbagdDevice objects supported by ratbagd."""
+        """A list of RatbagdDevice objects supported by ratbagd. The devices
+        are only created when first accessed. The list is updated in place
+        when devices are added or removed."""
         return self._devices
 
+    def get_device_properties_async(self, object_paths, names, callback, *args):
+        """Fetches the given properties of the given devices in one round
+        trip without creating their RatbagdDevice objects, e.g. to list
+        them.
+
+        @param object_paths The DBus object paths of the devices
+        @param names The DBus property names, e.g. ["Id", "Description"]
+        @param callback Called as callback(values, *args) with a list of
+                        tuples of the values in the order of names, one
+                        tuple per device in the order of object_paths;
+                        values are None where the device could not be
+                        queried
+        """
+        calls = [(p, "org.freedesktop.DBus.Properties", "Get",
+                  GLib.Variant("(ss)", ("org.freedesktop.ratbag1.Device", name)))
+                 for p in object_paths for name in names]
+
+        def on_replies(results):
+            results = [None if isinstance(r, GLib.GError) else r.unpack()[0]
+                       for r in results]
+            n = len(names)
+            callback([tuple(results[i:i + n]) for i in range(0, len(results), n)], *args)
+
+        self._connection.call_many_async(calls, on_replies)
+
+    def get_device_descriptions_async(self, object_paths, callback, *args):
+        """Fetches the descriptions of the given devices in one round trip,
+        see get_device_properties_async().
+
+        @param callback Called as callback(descriptions, *args) with a list
+                        of strings in the order of object_paths, None where
+                        the device could not be queried
+        """
+        def on_values(values):
+            callback([v[0] for v in values], *args)
+
+        self.get_device_properties_async(object_paths, ["Description"], on_values)
+
+    def get_device_descriptions(self, object_paths):
+        """Blocking variant of get_device_descriptions_async(), returns the
+        list of descriptions."""
+        return self._connection.run_sync(self.get_device_descriptions_async,
+                                         object_paths)[0]
+
 
 class RatbagdDevice(_RatbagdDBus):
     """Represents a ratbagd device."""
@@ -118,22 +1176,119 @@ class RatbagdDevice(_RatbagdDBus):
     CAP_BUTTON_MACROS = 302
     CAP_LED = 400
 
+    _PROPERTIES = {
+        "Id": "id",
+        "Capabilities": "capabilities",
+        "Description": "description",
+        "Svg": "svg",
+        "SvgPath": "svg-path",
+        "ActiveProfile": "active-profile",
+        "Profiles": "profiles",
+    }
+
+    _transaction = None
+    _profiles = None
+
     def __init__(self, object_path):
+        # Fetch the whole device in one go, the profiles, resolutions and
+        # buttons are then created without further round trips
+        connection = _RatbagdConnection.get()
+        if not connection.has_proxy(object_path):
+            connection.load_snapshot(object_path)
+
         _RatbagdDBus.__init__(self, "Device", object_path)
         self._objpath = object_path
+        self._load_properties()
+
+    def _load_properties(self):
+        # Keep the list and its objects unless the profiles changed
+        paths = self.dbus_property("Profiles") or []
+        if self._profiles is None or self._profiles.object_paths != paths:
+            self._profiles = _RatbagdLazyList(RatbagdProfile, paths, self._objpath)
+
         self._devnode = self.dbus_property("Id")
-        self._caps = self.dbus_property("Capabilities")
+        self._caps = frozenset(self.dbus_property("Capabilities") or ())
         self._description = self.dbus_property("Description")
         self._svg = self.dbus_property("Svg")
         self._svg_path = self.dbus_property("SvgPath")
 
-        self._profiles = []
         self._active_profile = -1
-        result = self.dbus_property("Profiles")
-        if result is not None:
-            self._profiles = [RatbagdProfile(objpath) for objpath in result]
+        if self.dbus_property("Profiles") is not None:
             self._active_profile = self.dbus_property("ActiveProfile")
 
+    @staticmethod
+    def new_async(object_path, callback, *args):
+        """Creates a RatbagdDevice including all of its profiles, resolutions
+        and buttons without blocking. The device state is fetched with
+        _RatbagdConnection.load_snapshot_async(), so this costs a small,
+        fixed number of bus messages regardless of the size of the device.
+
+        @param object_path The DBus object path of the device
+        @param callback Called as callback(device, error, *args) when done;
+                        device is None and error a GLib.GError on failure
+        """
+        connection = _RatbagdConnection.get()
+
+        def on_snapshot_loaded(error):
+            if error is not None:
+                callback(None, error, *args)
+                return
+
+            try:
+                device = connection.get_object(RatbagdDevice, object_path)
+                # Drains the proxy pool, no bus traffic from here on
+                for profile in device.profiles:
+                    profile.resolutions[:]
+                    profile.buttons[:]
+            except RatbagdDBusUnavailable:
+                error = GLib.GError("ratbagd is not available")
+                callback(None, error, *args)
+                return
+            callback(device, None, *args)
+
+        connection.load_snapshot_async(object_path, on_snapshot_loaded)
+
+    @staticmethod
+    def preload_state(state):
+        """Prepares a device from a state previously returned by
+        get_state(), e.g. one stored on disk, so that creating the
+        RatbagdDevice for its object path (directly or through
+        Ratbagd.devices) costs no further bus traffic. The state may be
+        outdated, call refresh_async() on the device afterwards to validate
+        it against ratbagd. Returns None or the GLib.GError.
+
+        @param state The GLib.Variant returned by get_state()
+        """
+        return _RatbagdConnection.get().import_snapshot(state)
+
+    def get_state(self):
+        """Returns the last known state of this device and all of its
+        profiles, resolutions and buttons as a GLib.Variant that can be
+        serialized, see preload_state(). Changes staged in an open
+        transaction are not included."""
+        objects = [self]
+        for profile in self._profiles:
+            objects.append(profile)
+            objects.extend(profile.resolutions)
+            objects.extend(profile.buttons)
+        return self._connection.export_snapshot(objects)
+
+    def refresh_async(self, callback, *args):
+        """Non-blocking variant of refresh(). Only the properties that
+        differ from the last known state emit notify.
+
+        @param callback Called as callback(error, *args) when done, error
+                        is None or a GLib.GError
+        """
+        self._connection.load_snapshot_async(self._objpath, callback, *args)
+
+    def refresh(self):
+        """Re-reads the complete state of this device, its profiles,
+        resolutions and buttons in a small, fixed number of bus messages and
+        updates the existing objects in place. Returns None or the
+        GLib.GError."""
+        return self._connection.load_snapshot(self._objpath)
+
     @GObject.Property
     def id(self):
         """The unique identifier of this device."""
@@ -141,14 +1296,16 @@ class RatbagdDevice(_RatbagdDBus):
 
     @GObject.Property
     def capabilities(self):
-        """The capabilities of this device as an array. Capabilities not
-        present on the device are not in the list. Thus use e.g.
-
-        if RatbagdDevice.CAP_SWITCHABLE_RESOLUTION is in device.capabilities:
-            do something
-        """
+        """The capabilities of this device as a frozenset, built once when
+        the properties are loaded. See has_capability()."""
         return self._caps
 
+    def has_capability(self, capability):
+        """True if the device has the given capability, e.g.
+        RatbagdDevice.CAP_SWITCHABLE_RESOLUTION. This does not query
+        ratbagd."""
+        return capability in self._caps
+
     @GObject.Property
     def description(self):
         """The device name, usually provided by the kernel."""
@@ -167,7 +1324,8 @@ class RatbagdDevice(_RatbagdDBus):
 
     @GObject.Property
     def profiles(self):
-        """A list of RatbagdProfile objects provided by this device."""
+        """A list of RatbagdProfile objects provided by this device. The
+        profiles are only created when first accessed."""
         return self._profiles
 
     @GObject.Property
@@ -178,16 +1336,25 @@ class RatbagdDevice(_RatbagdDBus):
             return None
         return self._profiles[self._active_profile]
 
+    def transaction(self):
+        """Opens a transaction on this device and returns the
+        RatbagdTransaction. Until it is committed or rolled back, changes to
+        the profiles, resolutions and buttons of this device are only staged
+        locally; their properties already return the staged values. Only
+        one transaction can be open at a time.
+        """
+        if self._transaction is not None:
+            raise ValueError("A transaction is already open on this device")
+        self._transaction = RatbagdTransaction(self)
+        return self._transaction
+
     def get_profile_by_index(self, index):
         """Returns the profile found at the given index, or None if no profile
-        was found.
+        was found. This does not query ratbagd.
 
         @param index The index to find the profile at, as int
         """
-        return self.dbus_call("GetProfileByIndex", "u", index)
-
-    def __eq__(self, other):
-        return other and self._objpath == other._objpath
+        return _find_by_index(self._profiles, index)
 
 
 class RatbagdProfile(_RatbagdDBus):
@@ -198,27 +1365,47 @@ class RatbagdProfile(_RatbagdDBus):
             (GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, [int]),
     }
 
-    def __init__(self, object_path):
-        _RatbagdDBus.__init__(self, "Profile", object_path)
-        self._proxy.connect("g-signal", self._on_g_signal)
+    _PROPERTIES = {
+        "Index": "index",
+        "Enabled": "enabled",
+        "ActiveResolution": "active-resolution",
+        "DefaultResolution": "default-resolution",
+        "Resolutions": "resolutions",
+        "Buttons": "buttons",
+    }
+
+    _WRITES = {
+        "SetEnabled": (("Enabled", "b", 0),),
+    }
+
+    _resolutions = None
+    _buttons = None
+
+    def __init__(self, object_path, device=None):
+        _RatbagdDBus.__init__(self, "Profile", object_path, device)
         self._objpath = object_path
+        self._load_properties()
+
+    def _load_properties(self):
+        paths = self.dbus_property("Resolutions") or []
+        if self._resolutions is None or self._resolutions.object_paths != paths:
+            self._resolutions = _RatbagdLazyList(RatbagdResolution, paths, self._device_path)
+        paths = self.dbus_property("Buttons") or []
+        if self._buttons is None or self._buttons.object_paths != paths:
+            self._buttons = _RatbagdLazyList(RatbagdButton, paths, self._device_path)
+
         self._index = self.dbus_property("Index")
-        self._resolutions = []
-        self._buttons = []
+        # ratbagd without profile disabling has no Enabled property
+        enabled = self.dbus_property("Enabled")
+        self._enabled = enabled if enabled is not None else True
+
         self._active_resolution_index = -1
         self._default_resolution_index = -1
-
-        result = self.dbus_property("Resolutions")
-        if result is not None:
-            self._resolutions = [RatbagdResolution(objpath) for objpath in result]
+        if self.dbus_property("Resolutions") is not None:
             self._active_resolution_index = self.dbus_property("ActiveResolution")
             self._default_resolution_index = self.dbus_property("DefaultResolution")
 
-        result = self.dbus_property("Buttons")
-        if result is not None:
-            self._buttons = [RatbagdButton(objpath) for objpath in result]
-
-    def _on_g_signal(self, proxy, sender, signal, params):
+    def _on_signal(self, signal, params):
         params = params.unpack()
         if signal == "ActiveProfileChanged":
             self.emit("active-profile-changed", params[0])
@@ -228,17 +1415,43 @@ class RatbagdProfile(_RatbagdDBus):
         """The index of this profile."""
         return self._index
 
+    @GObject.Property
+    def enabled(self):
+        """False if the profile is disabled, i.e. skipped when switching
+        profiles on the device."""
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, enabled):
+        """Enable or disable this profile. Only devices with
+        RatbagdDevice.CAP_DISABLE_PROFILE support this.
+
+        @param enabled True to enable the profile, as bool
+        """
+        self.dbus_write("enabled", "SetEnabled", "b", enabled)
+        self._enabled = enabled
+
+    def set_enabled_async(self, enabled, **kwargs):
+        """Non-blocking variant of setting the enabled property, takes the
+        keyword arguments of dbus_call_async() and returns its future."""
+        future = self.dbus_write_async("enabled", "SetEnabled", "b",
+                                       enabled, **kwargs)
+        self._enabled = enabled
+        self.notify("enabled")
+        return future
+
     @GObject.Property
     def resolutions(self):
         """A list of RatbagdResolution objects with this profile's resolutions.
-        """
+        The resolutions are only created when first accessed."""
         return self._resolutions
 
     @GObject.Property
     def buttons(self):
         """A list of RatbagdButton objects with this profile's button mappings.
         Note that the list of buttons differs between profiles but the number
-        of buttons is identical across profiles."""
+        of buttons is identical across profiles. The buttons are only created
+        when first accessed."""
         return self._buttons
 
     @GObject.Property
@@ -261,13 +1474,84 @@ class RatbagdProfile(_RatbagdDBus):
         """Set this profile to be the active profile."""
         return self.dbus_call("SetActive", "")
 
+    def set_active_async(self, **kwargs):
+        """Non-blocking variant of set_active(), takes the keyword arguments
+        of dbus_call_async() and returns its future."""
+        return self.dbus_call_async("SetActive", "", **kwargs)
+
     def get_resolution_by_index(self, index):
         """Returns the resolution found at the given index. This function
-        returns a RatbagdResolution or None if no resolution was found."""
-        return self.dbus_call("GetResolutionByIndex", "u", index)
-
-    def __eq__(self, other):
-        return self._objpath == other._objpath
+        returns a RatbagdResolution or None if no resolution was found. This
+        does not query ratbagd."""
+        return _find_by_index(self._resolutions, index)
+
+    def set_button_mappings_async(self, mappings, callback=None, timeout=500,
+                                  cancellable=None):
+        """Maps any number of buttons at once. All entries are first checked
+        locally with RatbagdButton.check_mapping(); if any is invalid,
+        ValueError is raised listing all invalid entries and nothing is
+        sent. The calls are then sent pipelined in one batch, or staged if
+        the device has an open transaction. The buttons return their new
+        mapping right away. Without a device, e.g. for a profile created
+        on its own, the batch is sent directly.
+
+        @param mappings A dict of button index to (action type, value)
+                        tuples, e.g. {0: ("button", 1), 5: ("key", [30,
+                        29]), 6: ("special", "wheel-up"), 7: ("none", None)}
+        @param callback Called as callback(failed) with the list of
+                        (button, method, GLib.GError) for the calls that
+                        failed, see RatbagdTransaction.commit_async()
+        """
+        calls = []
+        errors = []
+        for index, (action, value) in sorted(mappings.items()):
+            button = _find_by_index(self._buttons, index)
+            if button is None:
+                errors.append("No button {}".format(index))
+                continue
+            try:
+                calls.append((button, action, button.check_mapping(action, value)))
+            except ValueError as e:
+                errors.append(str(e))
+        if errors:
+            raise ValueError("; ".join(errors))
+
+        device = self._device
+        if device is None:
+            changes = [(button, method, type, args)
+                       for button, _, (method, type, args) in calls]
+            for button, action, (_, _, args) in calls:
+                button._set_mapping(action, args)
+
+            def on_replies(results):
+                failed = _apply_results(changes, results)
+                if callback is not None:
+                    callback(failed)
+
+            _RatbagdDBus.dbus_call_many_async(changes, on_replies, timeout, cancellable)
+            return
+
+        transaction = device._transaction
+        staged = transaction is not None
+        if not staged:
+            transaction = device.transaction()
+        for button, action, (method, type, args) in calls:
+            transaction.stage(button, "mapping", method, type, *args)
+            button._set_mapping(action, args)
+
+        if staged:
+            if callback is not None:
+                callback([])
+        else:
+            transaction.commit_async(callback or (lambda failed: None),
+                                     timeout, cancellable)
+
+    def set_button_mappings(self, mappings, timeout=500, cancellable=None):
+        """Blocking variant of set_button_mappings_async(), returns the list
+        of failed calls."""
+        def run(callback):
+            self.set_button_mappings_async(mappings, callback, timeout, cancellable)
+        return self._connection.run_sync(run)[0]
 
 
 class RatbagdResolution(_RatbagdDBus):
@@ -283,17 +1567,32 @@ class RatbagdResolution(_RatbagdDBus):
             (GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, [int]),
     }
 
-    def __init__(self, object_path):
-        _RatbagdDBus.__init__(self, "Resolution", object_path)
-        self._proxy.connect("g-signal", self._on_g_signal)
+    _PROPERTIES = {
+        "Index": "index",
+        "Capabilities": "capabilities",
+        "XResolution": "resolution",
+        "YResolution": "resolution",
+        "ReportRate": "report-rate",
+    }
+
+    _WRITES = {
+        "SetResolution": (("XResolution", "u", 0), ("YResolution", "u", 1)),
+        "SetReportRate": (("ReportRate", "u", 0),),
+    }
+
+    def __init__(self, object_path, device=None):
+        _RatbagdDBus.__init__(self, "Resolution", object_path, device)
         self._objpath = object_path
+        self._load_properties()
+
+    def _load_properties(self):
         self._index = self.dbus_property("Index")
-        self._caps = self.dbus_property("Capabilities")
+        self._caps = frozenset(self.dbus_property("Capabilities") or ())
         self._xres = self.dbus_property("XResolution")
         self._yres = self.dbus_property("YResolution")
         self._rate = self.dbus_property("ReportRate")
 
-    def _on_g_signal(self, proxy, sender, signal, params):
+    def _on_signal(self, signal, params):
         params = params.unpack()
         if signal == "ActiveResolutionChanged":
             self.emit("active-resolution-changed", params[0])
@@ -307,14 +1606,16 @@ class RatbagdResolution(_RatbagdDBus):
 
     @GObject.Property
     def capabilities(self):
-        """The capabilities of this resolution as a list. Capabilities not
-        present on the resolution are not in the list. Thus use e.g.
-
-        if RatbagdResolution.CAP_SEPARATE_XY_RESOLUTION is in resolution.capabilities:
-            do something
-        """
+        """The capabilities of this resolution as a frozenset, built once
+        when the properties are loaded. See has_capability()."""
         return self._caps
 
+    def has_capability(self, capability):
+        """True if the resolution has the given capability, e.g.
+        RatbagdResolution.CAP_SEPARATE_XY_RESOLUTION. This does not query
+        ratbagd."""
+        return capability in self._caps
+
     @GObject.Property
     def resolution(self):
         """The tuple (xres, yres) with each resolution in DPI."""
@@ -326,7 +1627,18 @@ class RatbagdResolution(_RatbagdDBus):
 
         @param res The new resolution, as (int, int)
         """
-        return self.dbus_call("SetResolution", "uu", *res)
+        self.dbus_write("resolution", "SetResolution", "uu", *res)
+        self._xres, self._yres = res
+
+    def set_resolution_async(self, res, **kwargs):
+        """Non-blocking variant of setting the resolution property, takes
+        the keyword arguments of dbus_call_async() and returns its future.
+        """
+        future = self.dbus_write_async("resolution", "SetResolution", "uu",
+                                       *res, **kwargs)
+        self._xres, self._yres = res
+        self.notify("resolution")
+        return future
 
     @GObject.Property
     def report_rate(self):
@@ -339,27 +1651,220 @@ class RatbagdResolution(_RatbagdDBus):
 
         @param rate The new report rate, as int
         """
-        return self.dbus_call("SetReportRate", "u", rate)
+        self.dbus_write("report-rate", "SetReportRate", "u", rate)
+        self._rate = rate
+
+    def set_report_rate_async(self, rate, **kwargs):
+        """Non-blocking variant of setting the report_rate property, takes
+        the keyword arguments of dbus_call_async() and returns its future.
+        """
+        future = self.dbus_write_async("report-rate", "SetReportRate", "u",
+                                       rate, **kwargs)
+        self._rate = rate
+        self.notify("report-rate")
+        return future
 
     def set_default(self):
         """Set this resolution to be the default."""
         return self.dbus_call("SetDefault", "")
 
+    def set_default_async(self, **kwargs):
+        """Non-blocking variant of set_default(), takes the keyword arguments
+        of dbus_call_async() and returns its future."""
+        return self.dbus_call_async("SetDefault", "", **kwargs)
+
+
+class RatbagdMacro(object):
+    """A sequence of key events as uploaded to a button by
+    RatbagdButton.macro, in the "a(uu)" format of ratbagd: a list of (type,
+    value) pairs where value is a keycode or, for WAIT, a delay in ms.
+
+    The events are kept interleaved in one array of unsigned ints rather
+    than as a list of tuples, recording an event appends two ints and
+    creates no Python objects.
+
+    @param events An iterable of (type, value) pairs
+    """
+
+    NONE = 0
+    KEY_PRESS = 1
+    KEY_RELEASE = 2
+    WAIT = 3
+
+    __slots__ = ("_events", "_last_time")
+
+    def __init__(self, events=()):
+        self._events = array.array("I")
+        for type, value in events:
+            self._events.append(type)
+            self._events.append(value)
+        self._last_time = None
+
+    def __len__(self):
+        return len(self._events) // 2
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Macro index out of range")
+        return (self._events[2 * index], self._events[2 * index + 1])
+
+    def __iter__(self):
+        events = self._events
+        return zip(events[0::2], events[1::2])
+
     def __eq__(self, other):
-        return self._objpath == other._objpath
+        return isinstance(other, RatbagdMacro) and self._events == other._events
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "RatbagdMacro({!r})".format(list(self))
+
+    def copy(self):
+        macro = RatbagdMacro()
+        macro._events = array.array("I", self._events)
+        return macro
+
+    def record(self, keycode, pressed, time=None):
+        """Appends a key event. If time is given, a WAIT for the time since
+        the previous recorded event is inserted before it. Repeated presses
+        of a key that is already down, i.e. key repeat, are dropped.
+
+        @param keycode The evdev keycode, as int
+        @param pressed True for a key press, False for a release
+        @param time The time of the event in ms, e.g. of a Gdk.Event
+        """
+        events = self._events
+        type = RatbagdMacro.KEY_PRESS if pressed else RatbagdMacro.KEY_RELEASE
+        if pressed and len(events) >= 2 and events[-2] == type and events[-1] == keycode:
+            return
+
+        if time is not None:
+            last = self._last_time
+            self._last_time = time
+            if last is not None and time > last:
+                events.append(RatbagdMacro.WAIT)
+                events.append(time - last)
+        events.append(type)
+        events.append(keycode)
+
+    def stop(self):
+        """Ends a recording, the next recorded event does not wait for the
+        last one."""
+        self._last_time = None
+
+    def trim(self, start=0, end=None):
+        """Keeps only the events from index start up to, excluding, index
+        end, like a slice. Delays at the new start and end are dropped as
+        they don't separate any events anymore."""
+        start, end, _ = slice(start, end).indices(len(self))
+        end = max(start, end)
+        events = self._events
+        del events[2 * end:]
+        del events[:2 * start]
+        while events and events[0] == RatbagdMacro.WAIT:
+            del events[:2]
+        while events and events[-2] == RatbagdMacro.WAIT:
+            del events[-2:]
+        self._last_time = None
+
+    def remove_last(self):
+        """Removes the last key stroke: the last key press, its release and
+        the delays before them. Keys pressed before it are kept even if
+        they are released after it."""
+        events = self._events
+        types = events[0::2]
+        presses = [i for i, type in enumerate(types) if type == RatbagdMacro.KEY_PRESS]
+        if not presses:
+            self.trim(0, -1)
+            return
+
+        press = presses[-1]
+        keycode = events[2 * press + 1]
+        remove = [press]
+        for i in range(press + 1, len(types)):
+            if types[i] == RatbagdMacro.KEY_RELEASE and events[2 * i + 1] == keycode:
+                remove.append(i)
+                break
+        # from the back so the indices before stay valid
+        for i in reversed(remove):
+            start = i - 1 if i > 0 and types[i - 1] == RatbagdMacro.WAIT else i
+            del events[2 * start:2 * i + 2]
+        self.trim()
+
+    def remove_delays(self):
+        """Removes all WAIT events, so the keys are sent as fast as the
+        device can."""
+        events = self._events
+        self._events = array.array("I")
+        for type, value in zip(events[0::2], events[1::2]):
+            if type != RatbagdMacro.WAIT:
+                self._events.append(type)
+                self._events.append(value)
+
+    def clear(self):
+        del self._events[:]
+        self._last_time = None
+
+    def keys(self):
+        """Returns the keycodes of the key presses in order."""
+        events = self._events
+        return [events[i + 1] for i in range(0, len(events), 2)
+                if events[i] == RatbagdMacro.KEY_PRESS]
+
+    def to_variant(self):
+        """Returns the events as "a(uu)" GLib.Variant."""
+        return GLib.Variant("a(uu)", list(self))
 
 
 class RatbagdButton(_RatbagdDBus):
     """Represents a ratbagd button."""
 
-    def __init__(self, object_path):
-        _RatbagdDBus.__init__(self, "Button", object_path)
+    # The method and signature that map a button to each action type
+    _MAPPING_CALLS = {
+        "none": ("Disable", ""),
+        "button": ("SetButtonMapping", "u"),
+        "special": ("SetSpecialMapping", "s"),
+        "key": ("SetKeyMapping", "au"),
+        "macro": ("SetMacro", "a(uu)"),
+    }
+
+    _PROPERTIES = {
+        "Index": "index",
+        "Type": "button-type",
+        "ButtonMapping": "button-mapping",
+        "SpecialMapping": "special",
+        "KeyMapping": "key",
+        "Macro": "macro",
+        "ActionType": "action-type",
+        "ActionTypes": "action-types",
+    }
+
+    _WRITES = {
+        "SetButtonMapping": (("ButtonMapping", "u", 0), ("ActionType", "s", "button")),
+        "SetSpecialMapping": (("SpecialMapping", "s", 0), ("ActionType", "s", "special")),
+        "SetKeyMapping": (("KeyMapping", "au", 0), ("ActionType", "s", "key")),
+        "SetMacro": (("Macro", "a(uu)", 0), ("ActionType", "s", "macro")),
+        "Disable": (("ActionType", "s", "none"),),
+    }
+
+    def __init__(self, object_path, device=None):
+        _RatbagdDBus.__init__(self, "Button", object_path, device)
         self._objpath = object_path
+        self._load_properties()
+
+    def _load_properties(self):
         self._index = self.dbus_property("Index")
         self._type = self.dbus_property("Type")
         self._button = self.dbus_property("ButtonMapping")
         self._special = self.dbus_property("SpecialMapping")
         self._key = self.dbus_property("KeyMapping")
+        self._macro = RatbagdMacro(self.dbus_property("Macro") or ())
         self._action = self.dbus_property("ActionType")
         self._types = self.dbus_property("ActionTypes")
 
@@ -384,7 +1889,21 @@ class RatbagdButton(_RatbagdDBus):
 
         @param button The button to map to, as int
         """
-        return self.dbus_call("SetButtonMapping", "u", button)
+        self.dbus_write("mapping", "SetButtonMapping", "u", button)
+        self._button = button
+        self._action = "button"
+
+    def set_button_mapping_async(self, button, **kwargs):
+        """Non-blocking variant of setting the button_mapping property, takes
+        the keyword arguments of dbus_call_async() and returns its future.
+        """
+        future = self.dbus_write_async("mapping", "SetButtonMapping", "u",
+                                       button, **kwargs)
+        self._button = button
+        self._action = "button"
+        self.notify("button-mapping")
+        self.notify("action-type")
+        return future
 
     @GObject.Property
     def special(self):
@@ -397,7 +1916,20 @@ class RatbagdButton(_RatbagdDBus):
 
         @param special The special entry, as str
         """
-        return self.dbus_call("SetSpecialMapping", "s", special)
+        self.dbus_write("mapping", "SetSpecialMapping", "s", special)
+        self._special = special
+        self._action = "special"
+
+    def set_special_async(self, special, **kwargs):
+        """Non-blocking variant of setting the special property, takes the
+        keyword arguments of dbus_call_async() and returns its future."""
+        future = self.dbus_write_async("mapping", "SetSpecialMapping", "s",
+                                       special, **kwargs)
+        self._special = special
+        self._action = "special"
+        self.notify("special")
+        self.notify("action-type")
+        return future
 
     @GObject.Property
     def key(self):
@@ -406,13 +1938,55 @@ class RatbagdButton(_RatbagdDBus):
         return self._key
 
     @key.setter
-    def key(self, key, modifiers):
+    def key(self, keys):
         """Set the key mapping.
 
-        @param key The keycode, as int
-        @param modifiers Modifier keycodes, as [int]
+        @param keys The keycode followed by the modifier keycodes, if any,
+                    as [int]
+        """
+        keys = list(keys)
+        self.dbus_write("mapping", "SetKeyMapping", "au", keys)
+        self._key = keys
+        self._action = "key"
+
+    def set_key_async(self, keys, **kwargs):
+        """Non-blocking variant of setting the key property, takes the
+        keyword arguments of dbus_call_async() and returns its future."""
+        keys = list(keys)
+        future = self.dbus_write_async("mapping", "SetKeyMapping", "au",
+                                       keys, **kwargs)
+        self._key = keys
+        self._action = "key"
+        self.notify("key")
+        self.notify("action-type")
+        return future
+
+    @GObject.Property
+    def macro(self):
+        """A RatbagdMacro with the events of the current macro, if mapped to
+        macro. Modifying it does not change the device, assign it again."""
+        return self._macro
+
+    @macro.setter
+    def macro(self, macro):
+        """Upload the macro in one call.
+
+        @param macro The RatbagdMacro to map to
         """
-        return self.dbus_call("SetKeyMapping", "au", [key].append(modifiers))
+        self.dbus_write("mapping", "SetMacro", "a(uu)", list(macro))
+        self._macro = macro.copy()
+        self._action = "macro"
+
+    def set_macro_async(self, macro, **kwargs):
+        """Non-blocking variant of setting the macro property, takes the
+        keyword arguments of dbus_call_async() and returns its future."""
+        future = self.dbus_write_async("mapping", "SetMacro", "a(uu)",
+                                       list(macro), **kwargs)
+        self._macro = macro.copy()
+        self._action = "macro"
+        self.notify("macro")
+        self.notify("action-type")
+        return future
 
     @GObject.Property
     def action_type(self):
@@ -427,6 +2001,88 @@ class RatbagdButton(_RatbagdDBus):
         """An array of possible values for ActionType."""
         return self._types
 
+    def check_mapping(self, action, value=None):
+        """Checks locally, without asking ratbagd, whether this button can
+        be mapped to the given action: the action type must be in
+        action_types, and key and macro need the matching device
+        capability. Raises ValueError if not, otherwise returns the
+        (method, signature, args) of the call that applies the mapping.
+
+        @param action The action type, one of "none", "button", "special",
+                      "key" or "macro"
+        @param value The button number as int, the special as str, the
+                     keycode followed by modifier keycodes as [int] or a
+                     RatbagdMacro; ignored for "none"
+        """
+        call = RatbagdButton._MAPPING_CALLS.get(action)
+        if call is None:
+            raise ValueError("Button {}: cannot map to {}".format(self._index, action))
+        if self._types is not None and action not in self._types:
+            raise ValueError("Button {} does not support {}".format(self._index, action))
+
+        if action == "key" or action == "macro":
+            cap = (RatbagdDevice.CAP_BUTTON_KEY if action == "key"
+                   else RatbagdDevice.CAP_BUTTON_MACROS)
+            device = self._device
+            if device is not None and not device.has_capability(cap):
+                raise ValueError("Button {}: the device does not support {} mappings".format(self._index, action))
+
+        method, type = call
+        if action == "none":
+            return method, type, ()
+        if action == "button":
+            if isinstance(value, bool) or not isinstance(value, int) \
+                    or not 1 <= value <= _UINT32_MAX:
+                raise ValueError("Button {}: invalid button {!r}".format(self._index, value))
+        elif action == "special":
+            if not isinstance(value, str) or not value:
+                raise ValueError("Button {}: invalid special {!r}".format(self._index, value))
+        elif action == "key":
+            try:
+                value = [int(k) for k in value]
+            except (TypeError, ValueError):
+                value = []
+            if not value or any(not 0 <= k <= _UINT32_MAX for k in value):
+                raise ValueError("Button {}: invalid key mapping".format(self._index))
+        elif action == "macro":
+            try:
+                value = [(int(t), int(v)) for t, v in value]
+            except (TypeError, ValueError):
+                raise ValueError("Button {}: invalid macro".format(self._index))
+            if not value:
+                raise ValueError("Button {}: empty macro".format(self._index))
+            for t, v in value:
+                if not RatbagdMacro.NONE <= t <= RatbagdMacro.WAIT or not 0 <= v <= _UINT32_MAX:
+                    raise ValueError("Button {}: invalid macro event {!r}".format(self._index, (t, v)))
+        return method, type, (value,)
+
+    def _set_mapping(self, action, args):
+        # Updates the cached mapping to what a call from check_mapping()
+        # writes
+        if action == "button":
+            self._button = args[0]
+            self.notify("button-mapping")
+        elif action == "special":
+            self._special = args[0]
+            self.notify("special")
+        elif action == "key":
+            self._key = args[0]
+            self.notify("key")
+        elif action == "macro":
+            self._macro = RatbagdMacro(args[0])
+            self.notify("macro")
+        self._action = action
+        self.notify("action-type")
+
     def disable(self):
         """Disables this button."""
-        return self.dbus_call("Disable", "")
+        self.dbus_write("mapping", "Disable", "")
+        self._action = "none"
+
+    def disable_async(self, **kwargs):
+        """Non-blocking variant of disable(), takes the keyword arguments of
+        dbus_call_async() and returns its future."""
+        future = self.dbus_write_async("mapping", "Disable", "", **kwargs)
+        self._action = "none"
+        self.notify("action-type")
+        return future
@@ -0,0 +1,95 @@
+# vim: set expandtab shiftwidth=4 tabstop=4:
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next
+# paragraph) shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""
+Records when each phase of Piper's startup finished. Import this module
+before anything else, its import time is the origin of all timestamps.
+
+Set PIPER_TRACE_STARTUP=1 to print the phases to stderr once startup is
+complete, or to a file name to write them there as JSON instead.
+"""
+
+import json
+import os
+import sys
+import time
+
+_origin = time.perf_counter()
+_phases = []
+_finished = False
+
+
+def mark(phase):
+    """Records that the given phase finished now. Only the first mark of
+    each phase is kept."""
+    if _finished:
+        return
+    if any(name == phase for name, _ in _phases):
+        return
+    _phases.append((phase, time.perf_counter() - _origin))
+
+
+def phases():
+    """Returns the list of (phase, seconds since the origin) tuples."""
+    return list(_phases)
+
+
+def dump(file=None):
+    """Prints the phases with their timestamp and the time they took."""
+    file = file if file is not None else sys.stderr
+    last = 0
+    print("Startup phases (ms):", file=file)
+    for name, t in _phases:
+        print("  {:<24} {:>9.2f} {:>+9.2f}".format(name, 1000 * t, 1000 * (t - last)),
+              file=file)
+        last = t
+
+
+def export(path):
+    """Writes the phases as JSON, a list of objects with the phase name and
+    its timestamp in ms."""
+    with open(path, "w") as f:
+        json.dump([{"phase": name, "ms": round(1000 * t, 3)} for name, t in _phases],
+                  f, indent=2)
+
+
+def finish():
+    """Marks the end of startup and reports the phases as requested by
+    PIPER_TRACE_STARTUP. Marks after this are ignored."""
+    global _finished
+
+    if _finished:
+        return
+    mark("startup-complete")
+    _finished = True
+
+    target = os.environ.get("PIPER_TRACE_STARTUP")
+    if not target:
+        return
+    if target == "1":
+        dump()
+    else:
+        try:
+            export(target)
+        except OSError as e:
+            print("Failed to write the startup trace: {}".format(e), file=sys.stderr)
@@ -0,0 +1,160 @@
+# vim: set expandtab shiftwidth=4 tabstop=4:
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next
+# paragraph) shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import unittest
+
+from piper.devicestate import (ButtonState, DeviceState, ProfileState,
+                               ResolutionState, Write, diff)
+
+
+def _state():
+    button = ButtonState(path="/b0", index=0, action_type="button",
+                         button_mapping=1, special="unknown", key=(0,), macro=())
+    resolution = ResolutionState(path="/r0", index=0, resolution=(800, 800),
+                                 report_rate=1000)
+    profile = ProfileState(path="/p0", index=0, default_resolution=0,
+                           resolutions=(resolution,), buttons=(button,))
+    return DeviceState(path="/d0", id="mouse", active_profile=0, profiles=(profile,))
+
+
+def _desired_button(**fields):
+    return DeviceState(profiles=(ProfileState(index=0, buttons=(ButtonState(index=0, **fields),)),))
+
+
+class TestState(unittest.TestCase):
+    def test_immutable(self):
+        state = _state()
+        with self.assertRaises(AttributeError):
+            state.id = "other"
+
+    def test_dict_roundtrip(self):
+        state = _state().replace(path=None)
+        self.assertEqual(DeviceState.from_dict(state.to_dict()).to_dict(), state.to_dict())
+
+    def test_from_dict_nested_lists_are_hashable(self):
+        state = ButtonState.from_dict({"index": 0, "macro": [[1, 30], [3, 20], [2, 30]]})
+        self.assertEqual(state.macro, ((1, 30), (3, 20), (2, 30)))
+        hash(state)
+
+    def test_from_dict_unknown_field(self):
+        with self.assertRaises(ValueError):
+            DeviceState.from_dict({"foo": 1})
+
+    def test_from_dict_invalid_values(self):
+        invalid = [
+            {"active_profile": -1},
+            {"active_profile": True},
+            {"id": 5},
+            {"profiles": {"index": 0}},
+            {"profiles": [{"index": -1}]},
+            {"profiles": [{"index": 0, "default_resolution": "0"}]},
+            {"profiles": [{"index": 0, "resolutions": [{"index": 0, "resolution": 800}]}]},
+            {"profiles": [{"index": 0, "resolutions": [{"index": 0, "resolution": [800, -5]}]}]},
+            {"profiles": [{"index": 0, "resolutions": [{"index": 0, "resolution": [800]}]}]},
+            {"profiles": [{"index": 0, "resolutions": [{"index": 0, "report_rate": 2 ** 32}]}]},
+            {"profiles": [{"index": 0, "buttons": [{"index": 0, "button_mapping": 1.5}]}]},
+            {"profiles": [{"index": 0, "buttons": [{"index": 0, "special": 1}]}]},
+            {"profiles": [{"index": 0, "buttons": [{"index": 0, "key": 30}]}]},
+            {"profiles": [{"index": 0, "buttons": [{"index": 0, "key": [30, "a"]}]}]},
+            {"profiles": [{"index": 0, "buttons": [{"index": 0, "macro": [1, 2]}]}]},
+            {"profiles": [{"index": 0, "buttons": [{"index": 0, "macro": [[1, 30, 0]]}]}]},
+            {"profiles": [{"index": 0, "buttons": [{"index": 0, "macro": [[4, 30]]}]}]},
+        ]
+        for values in invalid:
+            with self.assertRaises(ValueError, msg=values):
+                DeviceState.from_dict(values)
+
+    def test_from_dict_valid_values(self):
+        state = DeviceState.from_dict({"id": "mouse", "active_profile": 0, "profiles": [
+            {"index": 0, "default_resolution": 1,
+             "resolutions": [{"index": 0, "resolution": [800, 800], "report_rate": 1000}],
+             "buttons": [{"index": 0, "action_type": "key", "key": [30, 29],
+                          "macro": [[1, 30], [3, 20], [2, 30]]}]}]})
+        self.assertEqual(state.profiles[0].resolutions[0].resolution, (800, 800))
+        self.assertEqual(state.profiles[0].buttons[0].key, (30, 29))
+
+
+class TestDiff(unittest.TestCase):
+    def test_no_changes(self):
+        self.assertEqual(diff(_state(), _state()), [])
+
+    def test_resolution(self):
+        desired = DeviceState(profiles=(ProfileState(index=0, resolutions=(
+            ResolutionState(index=0, resolution=(1600, 1600), report_rate=1000),)),))
+        self.assertEqual(diff(_state(), desired),
+                         [Write("/r0", "resolution", "SetResolution", "uu", (1600, 1600))])
+
+    def test_active_profile_last(self):
+        current = _state()
+        other = current.profiles[0].replace(path="/p1", index=1)
+        current = current.replace(profiles=current.profiles + (other,))
+        desired = DeviceState(active_profile=1, profiles=(ProfileState(index=0, buttons=(
+            ButtonState(index=0, button_mapping=2),)),))
+        writes = diff(current, desired)
+        self.assertEqual([w.method for w in writes], ["SetButtonMapping", "SetActive"])
+
+    def test_wrong_device(self):
+        with self.assertRaises(ValueError):
+            diff(_state(), DeviceState(id="other"))
+
+    def test_missing_objects(self):
+        with self.assertRaises(ValueError):
+            diff(_state(), DeviceState(active_profile=3))
+        with self.assertRaises(ValueError):
+            diff(_state(), _desired_button().replace(
+                profiles=(ProfileState(index=0, buttons=(ButtonState(index=5),)),)))
+
+    def test_button_implied_action(self):
+        writes = diff(_state(), _desired_button(special="wheel-up"))
+        self.assertEqual(writes, [Write("/b0", "mapping", "SetSpecialMapping", "s", ("wheel-up",))])
+
+    def test_button_action_without_value(self):
+        # the current state has no key and no macro to fall back to
+        for action in ("key", "macro"):
+            with self.assertRaises(ValueError):
+                diff(_state(), _desired_button(action_type=action))
+        current = _state()
+        button = current.profiles[0].buttons[0].replace(special=None)
+        current = current.with_profile(current.profiles[0].replace(buttons=(button,)))
+        with self.assertRaises(ValueError):
+            diff(current, _desired_button(action_type="special"))
+
+    def test_button_action_keeps_current_value(self):
+        writes = diff(_state(), _desired_button(action_type="special"))
+        self.assertEqual(writes, [Write("/b0", "mapping", "SetSpecialMapping", "s", ("unknown",))])
+
+    def test_button_macro_from_dict(self):
+        desired = DeviceState.from_dict({"profiles": [{"index": 0, "buttons": [
+            {"index": 0, "macro": [[1, 30], [2, 30]]}]}]})
+        writes = diff(_state(), desired)
+        self.assertEqual(writes, [Write("/b0", "mapping", "SetMacro", "a(uu)",
+                                        ([(1, 30), (2, 30)],))])
+
+    def test_button_disable(self):
+        writes = diff(_state(), _desired_button(action_type="none"))
+        self.assertEqual(writes, [Write("/b0", "mapping", "Disable", "", ())])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+# vim: set expandtab shiftwidth=4 tabstop=4:
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next
+# paragraph) shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+
+import unittest
+
+try:
+    from piper.ratbagd import RatbagdMacro
+except ImportError:
+    RatbagdMacro = None
+
+P = 1  # RatbagdMacro.KEY_PRESS
+R = 2  # RatbagdMacro.KEY_RELEASE
+W = 3  # RatbagdMacro.WAIT
+
+
+@unittest.skipUnless(RatbagdMacro, "requires PyGObject")
+class TestMacro(unittest.TestCase):
+    def test_events(self):
+        macro = RatbagdMacro([(P, 30), (W, 20), (R, 30)])
+        self.assertEqual(len(macro), 3)
+        self.assertEqual(list(macro), [(P, 30), (W, 20), (R, 30)])
+        self.assertEqual(macro[-1], (R, 30))
+        with self.assertRaises(IndexError):
+            macro[3]
+        self.assertEqual(macro.keys(), [30])
+
+    def test_equality(self):
+        macro = RatbagdMacro([(P, 30), (R, 30)])
+        copy = macro.copy()
+        self.assertEqual(macro, copy)
+        copy.clear()
+        self.assertNotEqual(macro, copy)
+        self.assertEqual(len(macro), 2)
+        with self.assertRaises(TypeError):
+            hash(macro)
+
+    def test_record(self):
+        macro = RatbagdMacro()
+        macro.record(30, True, 1000)
+        macro.record(30, True, 1010)
+        macro.record(30, False, 1050)
+        macro.stop()
+        macro.record(48, True, 5000)
+        self.assertEqual(list(macro), [(P, 30), (W, 50), (R, 30), (P, 48)])
+
+    def test_trim(self):
+        macro = RatbagdMacro([(P, 30), (W, 20), (R, 30), (W, 10), (P, 48)])
+        macro.trim(1, 4)
+        self.assertEqual(list(macro), [(R, 30)])
+
+    def test_remove_last(self):
+        macro = RatbagdMacro([(P, 30), (W, 20), (R, 30), (W, 10),
+                              (P, 48), (W, 20), (R, 48)])
+        macro.remove_last()
+        self.assertEqual(list(macro), [(P, 30), (W, 20), (R, 30)])
+        macro.remove_last()
+        self.assertEqual(list(macro), [])
+        macro.remove_last()
+        self.assertEqual(list(macro), [])
+
+    def test_remove_last_keeps_held_keys(self):
+        macro = RatbagdMacro([(P, 42), (W, 10), (P, 30), (W, 20),
+                              (R, 30), (W, 10), (R, 42)])
+        macro.remove_last()
+        self.assertEqual(list(macro), [(P, 42), (W, 10), (R, 42)])
+
+    def test_remove_last_unreleased(self):
+        macro = RatbagdMacro([(P, 30), (W, 20), (R, 30), (W, 10), (P, 48)])
+        macro.remove_last()
+        self.assertEqual(list(macro), [(P, 30), (W, 20), (R, 30)])
+
+    def test_remove_last_without_press(self):
+        macro = RatbagdMacro([(R, 30), (W, 10), (R, 48)])
+        macro.remove_last()
+        self.assertEqual(list(macro), [(R, 30)])
+
+    def test_remove_delays(self):
+        macro = RatbagdMacro([(P, 30), (W, 20), (R, 30)])
+        macro.remove_delays()
+        self.assertEqual(list(macro), [(P, 30), (R, 30)])
+
+
+if __name__ == "__main__":
+    unittest.main()
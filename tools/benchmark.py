@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# vim: set expandtab shiftwidth=4 tabstop=4:
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next
+# paragraph) shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""
+Benchmarks the ratbagd bindings against tools/mock_ratbagd.py.
+
+A private dbus-daemon and the mock service are started for the run, the
+bindings are pointed at them through DBUS_SYSTEM_BUS_ADDRESS. For each
+scenario, the wall time and the number of calls that reached the service
+are reported:
+
+    ./tools/benchmark.py --profiles 5 --buttons 12 --latency 2
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+srcdir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, srcdir)
+
+
+def start_bus():
+    bus = subprocess.Popen(["dbus-daemon", "--session", "--nofork", "--print-address=1"],
+                           stdout=subprocess.PIPE, universal_newlines=True)
+    address = bus.stdout.readline().strip()
+    if not address:
+        bus.kill()
+        sys.exit("Failed to start a private dbus-daemon")
+    return bus, address
+
+
+def start_mock(args):
+    cmd = [sys.executable, os.path.join(srcdir, "tools", "mock_ratbagd.py"),
+           "--devices", str(args.devices),
+           "--profiles", str(args.profiles),
+           "--resolutions", str(args.resolutions),
+           "--buttons", str(args.buttons),
+           "--latency", str(args.latency)]
+    if args.object_manager:
+        cmd.append("--object-manager")
+    return subprocess.Popen(cmd)
+
+
+class Benchmark(object):
+    def __init__(self, args):
+        from gi.repository import Gio, GLib
+        from piper import ratbagd
+
+        self._args = args
+        self._Gio = Gio
+        self._GLib = GLib
+        self._ratbagd = ratbagd
+        self._bus = Gio.bus_get_sync(Gio.BusType.SYSTEM, None)
+        self._wait_for_service()
+        if args.stats:
+            ratbagd.enable_stats()
+
+    def _wait_for_service(self):
+        GLib = self._GLib
+        for _ in range(100):
+            res = self._bus.call_sync("org.freedesktop.DBus", "/org/freedesktop/DBus",
+                                      "org.freedesktop.DBus", "NameHasOwner",
+                                      GLib.Variant("(s)", ("org.freedesktop.ratbag1",)),
+                                      None, self._Gio.DBusCallFlags.NONE, -1, None)
+            if res.unpack()[0]:
+                return
+            time.sleep(0.05)
+        sys.exit("The mock ratbagd did not show up on the bus")
+
+    def _mock_call(self, method):
+        res = self._bus.call_sync("org.freedesktop.ratbag1", "/org/freedesktop/ratbag1",
+                                  "org.freedesktop.ratbag1.Mock", method, None, None,
+                                  self._Gio.DBusCallFlags.NONE, -1, None)
+        return res.unpack()[0] if method == "GetStats" else None
+
+    def _fresh_bindings(self):
+        # Start every run from a cold connection, like a new Piper process.
+        # The shared GDBusConnection stays, so the previous connection must
+        # drop its signal subscription or every signal is dispatched once
+        # per run.
+        connection = self._ratbagd._RatbagdConnection._instance
+        if connection is not None:
+            connection.close()
+
+    def measure(self, name, setup, func):
+        times, calls = [], []
+        for _ in range(self._args.repeat):
+            self._fresh_bindings()
+            state = setup()
+            self._mock_call("ResetStats")
+            self._ratbagd.reset_stats()
+            t = time.perf_counter()
+            func(state)
+            times.append(time.perf_counter() - t)
+            calls.append(self._mock_call("GetStats"))
+
+        total = [sum(c.values()) for c in calls]
+        print("{:<28} {:>9.2f} ms {:>8} calls".format(name, 1000 * min(times), min(total)))
+        if self._args.verbose:
+            for method, count in sorted(calls[-1].items()):
+                print("    {:<50} {:>6}".format(method, count))
+        if self._args.stats:
+            self._ratbagd.dump_stats(sys.stdout)
+
+    def _device(self):
+        return self._ratbagd.Ratbagd().devices[0]
+
+    def run(self):
+        ratbagd = self._ratbagd
+
+        def enumerate_all(ratbag):
+            for device in ratbag.devices:
+                for profile in device.profiles:
+                    for r in profile.resolutions:
+                        r.resolution
+                    for b in profile.buttons:
+                        b.action_type
+
+        self.measure("enumeration", lambda: None,
+                     lambda _: enumerate_all(ratbagd.Ratbagd()))
+
+        def switch_profiles(device):
+            for profile in device.profiles:
+                profile.set_active()
+                for r in profile.resolutions:
+                    r.resolution
+                for b in profile.buttons:
+                    b.action_type
+
+        self.measure("profile switching", self._device, switch_profiles)
+
+        def write_direct(device):
+            for profile in device.profiles:
+                for r in profile.resolutions:
+                    r.resolution = (800, 800)
+                for b in profile.buttons:
+                    b.button_mapping = 1
+
+        def write_transaction(device):
+            with device.transaction():
+                write_direct(device)
+
+        def write_batch(device):
+            calls = []
+            for profile in device.profiles:
+                for r in profile.resolutions:
+                    calls.append((r, "SetResolution", "uu", (800, 800)))
+                for b in profile.buttons:
+                    calls.append((b, "SetButtonMapping", "u", (1,)))
+            ratbagd.RatbagdDevice.dbus_call_many(calls, timeout=5000)
+
+        def remap_direct(device):
+            for b in device.profiles[0].buttons:
+                b.key = [30, 29]
+
+        def remap_bulk(device):
+            profile = device.profiles[0]
+            profile.set_button_mappings({b.index: ("key", [30, 29]) for b in profile.buttons},
+                                        timeout=5000)
+
+        self.measure("bulk writes, direct", self._device, write_direct)
+        self.measure("bulk writes, transaction", self._device, write_transaction)
+        self.measure("bulk writes, batch", self._device, write_batch)
+        self.measure("button remap, direct", self._device, remap_direct)
+        self.measure("button remap, bulk", self._device, remap_bulk)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ratbagd bindings")
+    parser.add_argument("--devices", type=int, default=1)
+    parser.add_argument("--profiles", type=int, default=5)
+    parser.add_argument("--resolutions", type=int, default=5)
+    parser.add_argument("--buttons", type=int, default=12)
+    parser.add_argument("--latency", type=int, default=1,
+                        help="Delay of every reply of the mock in ms")
+    parser.add_argument("--object-manager", action="store_true",
+                        help="Let the mock implement org.freedesktop.DBus.ObjectManager")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Runs per scenario, the best one is reported")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Print the calls per method")
+    parser.add_argument("--stats", action="store_true",
+                        help="Print the client side statistics of the bindings")
+    args = parser.parse_args()
+
+    bus, address = start_bus()
+    os.environ["DBUS_SYSTEM_BUS_ADDRESS"] = address
+    mock = start_mock(args)
+    try:
+        Benchmark(args).run()
+    finally:
+        mock.terminate()
+        bus.terminate()
+
+
+if __name__ == "__main__":
+    main()
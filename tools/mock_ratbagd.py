@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# vim: set expandtab shiftwidth=4 tabstop=4:
+#
+# Copyright 2016 Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice (including the next
+# paragraph) shall be included in all copies or substantial portions of the
+# Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+"""
+A stand-in for ratbagd with synthetic devices, for benchmarking Piper and
+the ratbagd bindings without hardware.
+
+The service connects to the bus ratbagd.py uses, i.e. the system bus
+unless DBUS_SYSTEM_BUS_ADDRESS points elsewhere, so run it on a private
+bus:
+
+    dbus-daemon --session --print-address --fork
+    export DBUS_SYSTEM_BUS_ADDRESS=<the address printed above>
+    ./tools/mock_ratbagd.py --profiles 5 --buttons 12
+
+All method calls, including the org.freedesktop.DBus.Properties ones, are
+answered after --latency milliseconds without blocking other calls, so
+pipelined calls overlap like they would on a real bus. The calls are
+counted per interface and method and can be queried and reset through the
+org.freedesktop.ratbag1.Mock interface on /org/freedesktop/ratbag1.
+"""
+
+import argparse
+import collections
+import sys
+import threading
+
+import gi
+gi.require_version('Gio', '2.0')
+from gi.repository import Gio, GLib
+
+NAME = "org.freedesktop.ratbag1"
+ROOT = "/org/freedesktop/ratbag1"
+
+SPECIALS = ["doubleclick", "wheel-up", "wheel-down", "resolution-up",
+            "resolution-down", "profile-cycle-up"]
+
+
+class MockError(Exception):
+    def __init__(self, name, message):
+        Exception.__init__(self, message)
+        self.name = name
+
+
+class MockObject(object):
+    def __init__(self, interface, parent=None, **props):
+        self.interface = "{}.{}".format(NAME, interface)
+        self.parent = parent
+        self.props = props
+
+
+class MockRatbagd(object):
+    """The synthetic ratbagd. Each object is a MockObject keyed by its
+    object path, holding its properties as GLib.Variant."""
+
+    def __init__(self, connection, args):
+        self._connection = connection
+        self._latency = args.latency
+        self._object_manager = args.object_manager
+        self._stats = collections.Counter()
+        self._lock = threading.Lock()
+        self.objects = {}
+
+        devices = [self._add_device(i, args) for i in range(args.devices)]
+        self.objects[ROOT] = MockObject("Manager",
+                                        Devices=GLib.Variant("ao", devices))
+
+    def _add_device(self, d, args):
+        name = "mock{}".format(d)
+        path = "{}/device/{}".format(ROOT, name)
+        profiles = []
+        for p in range(args.profiles):
+            ppath = "{}/profile/{}/p{}".format(ROOT, name, p)
+            resolutions = []
+            for r in range(args.resolutions):
+                rpath = "{}/resolution/{}/p{}/r{}".format(ROOT, name, p, r)
+                self.objects[rpath] = MockObject(
+                    "Resolution", ppath,
+                    Index=GLib.Variant("u", r),
+                    Capabilities=GLib.Variant("au", [1, 2]),
+                    XResolution=GLib.Variant("u", 400 * (r + 1)),
+                    YResolution=GLib.Variant("u", 400 * (r + 1)),
+                    ReportRate=GLib.Variant("u", 1000))
+                resolutions.append(rpath)
+            buttons = []
+            for b in range(args.buttons):
+                bpath = "{}/button/{}/p{}/b{}".format(ROOT, name, p, b)
+                self.objects[bpath] = MockObject(
+                    "Button", ppath,
+                    Index=GLib.Variant("u", b),
+                    Type=GLib.Variant("s", "unknown"),
+                    ButtonMapping=GLib.Variant("u", b + 1),
+                    SpecialMapping=GLib.Variant("s", SPECIALS[b % len(SPECIALS)]),
+                    KeyMapping=GLib.Variant("au", [0]),
+                    Macro=GLib.Variant("a(uu)", []),
+                    ActionType=GLib.Variant("s", "button" if b < 5 else "special"),
+                    ActionTypes=GLib.Variant("as", ["none", "button", "key", "special", "macro"]))
+                buttons.append(bpath)
+            self.objects[ppath] = MockObject(
+                "Profile", path,
+                Index=GLib.Variant("u", p),
+                Enabled=GLib.Variant("b", True),
+                Resolutions=GLib.Variant("ao", resolutions),
+                Buttons=GLib.Variant("ao", buttons),
+                ActiveResolution=GLib.Variant("u", 0),
+                DefaultResolution=GLib.Variant("u", 0))
+            profiles.append(ppath)
+
+        self.objects[path] = MockObject(
+            "Device", ROOT,
+            Id=GLib.Variant("s", name),
+            Capabilities=GLib.Variant("au", [1, 100, 101, 200, 201, 202, 300, 301, 302]),
+            Description=GLib.Variant("s", "Mock Mouse {}".format(d)),
+            Svg=GLib.Variant("s", "mock.svg"),
+            SvgPath=GLib.Variant("s", "/nonexistent/mock.svg"),
+            Profiles=GLib.Variant("ao", profiles),
+            ActiveProfile=GLib.Variant("u", 0))
+        return path
+
+    def filter(self, connection, message, incoming, *user_data):
+        """Takes over all method calls to our objects; runs in the GDBus
+        worker thread."""
+        if not incoming:
+            return message
+        if message.get_message_type() != Gio.DBusMessageType.METHOD_CALL:
+            return message
+        if message.get_path() not in self.objects:
+            return message
+
+        with self._lock:
+            self._stats["{}.{}".format(message.get_interface(), message.get_member())] += 1
+        GLib.timeout_add(self._latency, self._handle, message)
+        return None
+
+    def _handle(self, message):
+        try:
+            body = self._dispatch(message.get_path(), message.get_interface(),
+                                  message.get_member(), message.get_body())
+            reply = Gio.DBusMessage.new_method_reply(message)
+            if body is not None:
+                reply.set_body(body)
+        except MockError as e:
+            reply = Gio.DBusMessage.new_method_error_literal(message, e.name, str(e))
+        self._connection.send_message(reply, Gio.DBusSendMessageFlags.NONE)
+        return False
+
+    def _set(self, path, **props):
+        obj = self.objects[path]
+        obj.props.update(props)
+        self._connection.emit_signal(None, path, "org.freedesktop.DBus.Properties",
+                                     "PropertiesChanged",
+                                     GLib.Variant("(sa{sv}as)", (obj.interface, props, [])))
+
+    def _dispatch(self, path, interface, member, params):
+        obj = self.objects[path]
+        args = params.unpack() if params is not None else ()
+
+        if interface == "org.freedesktop.DBus.Properties":
+            if member == "GetAll" and args[0] == obj.interface:
+                return GLib.Variant("(a{sv})", (obj.props,))
+            if member == "Get" and args[0] == obj.interface and args[1] in obj.props:
+                return GLib.Variant("(v)", (obj.props[args[1]],))
+            raise MockError("org.freedesktop.DBus.Error.InvalidArgs",
+                            "No such property or interface")
+
+        if self._object_manager and path == ROOT and member == "GetManagedObjects":
+            objects = {p: {o.interface: o.props}
+                       for p, o in self.objects.items() if p != ROOT}
+            return GLib.Variant("(a{oa{sa{sv}}})", (objects,))
+
+        if interface == "{}.Mock".format(NAME) and path == ROOT:
+            if member == "GetStats":
+                with self._lock:
+                    return GLib.Variant("(a{su})", (dict(self._stats),))
+            if member == "ResetStats":
+                with self._lock:
+                    self._stats.clear()
+                return None
+
+        if interface == obj.interface:
+            handler = getattr(self, "_{}_{}".format(interface.split(".")[-1], member), None)
+            if handler is not None:
+                return handler(path, obj, *args)
+
+        raise MockError("org.freedesktop.DBus.Error.UnknownMethod",
+                        "Unknown method {}.{}".format(interface, member))
+
+    def _Device_GetProfileByIndex(self, path, obj, index):
+        return GLib.Variant("(o)", (obj.props["Profiles"].unpack()[index],))
+
+    def _Profile_SetActive(self, path, obj):
+        self._set(obj.parent, ActiveProfile=obj.props["Index"])
+        return None
+
+    def _Profile_SetEnabled(self, path, obj, enabled):
+        self._set(path, Enabled=GLib.Variant("b", enabled))
+        return None
+
+    def _Profile_GetResolutionByIndex(self, path, obj, index):
+        return GLib.Variant("(o)", (obj.props["Resolutions"].unpack()[index],))
+
+    def _Resolution_SetResolution(self, path, obj, xres, yres):
+        self._set(path, XResolution=GLib.Variant("u", xres),
+                  YResolution=GLib.Variant("u", yres))
+        return None
+
+    def _Resolution_SetReportRate(self, path, obj, rate):
+        self._set(path, ReportRate=GLib.Variant("u", rate))
+        return None
+
+    def _Resolution_SetDefault(self, path, obj):
+        self._set(obj.parent, DefaultResolution=obj.props["Index"])
+        return None
+
+    def _Button_SetButtonMapping(self, path, obj, button):
+        self._set(path, ButtonMapping=GLib.Variant("u", button),
+                  ActionType=GLib.Variant("s", "button"))
+        return None
+
+    def _Button_SetSpecialMapping(self, path, obj, special):
+        self._set(path, SpecialMapping=GLib.Variant("s", special),
+                  ActionType=GLib.Variant("s", "special"))
+        return None
+
+    def _Button_SetKeyMapping(self, path, obj, keys):
+        self._set(path, KeyMapping=GLib.Variant("au", keys),
+                  ActionType=GLib.Variant("s", "key"))
+        return None
+
+    def _Button_SetMacro(self, path, obj, events):
+        self._set(path, Macro=GLib.Variant("a(uu)", events),
+                  ActionType=GLib.Variant("s", "macro"))
+        return None
+
+    def _Button_Disable(self, path, obj):
+        self._set(path, ActionType=GLib.Variant("s", "none"))
+        return None
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Mock ratbagd service")
+    parser.add_argument("--devices", type=int, default=1)
+    parser.add_argument("--profiles", type=int, default=5)
+    parser.add_argument("--resolutions", type=int, default=5)
+    parser.add_argument("--buttons", type=int, default=12)
+    parser.add_argument("--latency", type=int, default=1,
+                        help="Delay of every reply in ms")
+    parser.add_argument("--object-manager", action="store_true",
+                        help="Implement org.freedesktop.DBus.ObjectManager")
+    return parser.parse_args(argv)
+
+
+def main(argv=sys.argv[1:]):
+    args = parse_args(argv)
+    connection = Gio.bus_get_sync(Gio.BusType.SYSTEM, None)
+    service = MockRatbagd(connection, args)
+    connection.add_filter(service.filter)
+
+    connection.call_sync("org.freedesktop.DBus", "/org/freedesktop/DBus",
+                         "org.freedesktop.DBus", "RequestName",
+                         GLib.Variant("(su)", (NAME, 4)),  # DO_NOT_QUEUE
+                         None, Gio.DBusCallFlags.NONE, -1, None)
+
+    GLib.MainLoop().run()
+
+
+if __name__ == "__main__":
+    main()